@@ -0,0 +1,161 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, re, json, hashlib, shlex, tempfile
+from util import sobstitute
+import pycall
+
+# parameters which change the way a configuration is executed without
+# appearing in its commands
+RUN_PARAMS = [ 'num_of_runs', 'kill_after', 'ci_target', 'ci_column', 'min_runs', 'max_runs', 
+               'py_warmup', 'py_gc' ]
+
+# fingerprints of the files already hashed, indexed by (path, size, mtime)
+_fingerprints = {}
+
+def fingerprint(file_name):
+    """ Returns the SHA1 of the content of 'file_name' """
+    st = os.stat(file_name)
+    key = (os.path.abspath(file_name), st.st_size, st.st_mtime)
+    if key not in _fingerprints:
+        sha = hashlib.sha1()
+        f = open(file_name, 'rb')
+        for chunk in iter(lambda: f.read(1024 * 1024), ''):
+            sha.update(chunk)
+        f.close()
+        _fingerprints[key] = sha.hexdigest()
+    return _fingerprints[key]
+
+def find_executable(name):
+    if os.path.dirname(name):
+        return name if os.path.isfile(name) else None
+    for path in os.environ.get('PATH', '').split(os.pathsep):
+        candidate = os.path.join(path, name)
+        if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+            return candidate
+
+def referenced_params(templates, conf):
+    """ Returns the names of the parameters of 'conf' the templates refer to,
+    directly or through the value of other parameters """
+    names = set()
+    todo = list(templates)
+    while todo:
+        for name in re.findall('{(\w+)', todo.pop()):
+            if name in names or name not in conf.parameters:
+                continue
+            names.add(name)
+            todo.append( str(conf.parameters[name].currValue()) )
+    return names
+
+class ResultCache:
+    """ Persistent store of the results of the configurations already executed.
+    Results are addressed by a hash of the rendered commands, the values of the
+    parameters they depend on, the content of the files they use (executable
+    and arguments) and the content of the files listed by the 'cache_inputs'
+    parameter. The file of the module of a Python callable (py:module:function)
+    is part of the hash as well. """
+
+    def __init__(self, directory, invalidate=False, salt=''):
+        self.__dir = directory
+        # when invalidating, cached results are never read but overwritten
+        self.__invalidate = invalidate
+        self.__salt = salt
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, cmd_list, conf):
+        """ The hash addressing the results of 'cmd_list' for 'conf'
+        
+        >>> import shutil
+        >>> from configuration import Configuration
+        >>> from parameter import Parameter
+        >>> (cwd, work) = (os.getcwd(), tempfile.mkdtemp())
+        >>> os.chdir(work)
+        >>> open('kernel.py', 'w').write('def run(n):\\n    pass\\n')
+        >>> conf = Configuration()
+        >>> conf += Parameter('n', [10], 10)
+        >>> conf += Parameter('py_warmup', [0, 3], 0)
+        >>> cache = ResultCache(os.path.join(work, 'cache'))
+        >>> key = cache.key([ 'py:kernel:run {n}' ], conf)
+        >>> open('kernel.py', 'w').write('def run(n):\\n    return n * n\\n')
+        >>> key == cache.key([ 'py:kernel:run {n}' ], conf)
+        False
+        >>> key = cache.key([ 'py:kernel:run {n}' ], conf)
+        >>> conf.py_warmup.next()
+        3
+        >>> key == cache.key([ 'py:kernel:run {n}' ], conf)
+        False
+        >>> os.chdir(cwd)
+        >>> shutil.rmtree(work)
+        """
+        desc = { 'salt': self.__salt, 'cmds': [], 'params': {}, 'files': {} }
+        templates = list(cmd_list)
+        for cmd in cmd_list:
+            curr_cmd = sobstitute(cmd, conf).replace('\\\n','')
+            desc['cmds'].append( curr_cmd )
+            if curr_cmd.find('>>') != -1:
+                curr_cmd = curr_cmd[:curr_cmd.rfind('>>')]
+            if pycall.is_call(curr_cmd):
+                file_name = pycall.module_file(curr_cmd)
+                if file_name:
+                    desc['files'][file_name] = fingerprint(file_name)
+            tokens = shlex.split(curr_cmd)
+            if tokens:
+                tokens[0] = find_executable(tokens[0]) or tokens[0]
+            for token in tokens:
+                if os.path.isfile(token):
+                    desc['files'][token] = fingerprint(token)
+
+        if 'cache_inputs' in conf.parameters:
+            templates.append( str(conf.cache_inputs.currValue()) )
+            for file_name in sobstitute(str(conf.cache_inputs.currValue()), conf).split():
+                desc['files'][file_name] = fingerprint(file_name) if os.path.exists(file_name) else None
+
+        names = referenced_params(templates, conf) | \
+                set([ name for name in RUN_PARAMS if name in conf.parameters ])
+        for name in names:
+            desc['params'][name] = conf.parameters[name].currValue()
+        return hashlib.sha1( json.dumps(desc, sort_keys=True) ).hexdigest()
+
+    def __path(self, key):
+        return os.path.join(self.__dir, key[:2], key[2:] + '.json')
+
+    def lookup(self, key):
+        """ Returns the results stored for 'key' (a dictionary with the 'data',
+        'failures', 'runs' and 'metrics' entries) or None """
+        if self.__invalidate or not os.path.exists(self.__path(key)):
+            return None
+        try:
+            return json.load( open(self.__path(key)) )
+        except ValueError:
+            # corrupted entry
+            return None
+
+    def store(self, key, data, failures, runs, metrics=None):
+        path = self.__path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        # the entry is written onto a temporary file and then renamed, this way
+        # an interrupted write never leaves a corrupted entry
+        (fd, tmp_file) = tempfile.mkstemp(dir=os.path.dirname(path))
+        f = os.fdopen(fd, 'w')
+        json.dump( { 'data': [ list(row) for row in data ], 'failures': failures, 'runs': runs,
+                     'metrics': metrics or [] }, f )
+        f.close()
+        os.rename(tmp_file, path)
@@ -81,8 +81,9 @@ def parse(str):
     step = 1
     
     if str.startswith('['):
-        # split the list of values from the default value (if present)
-        at_idx = str.find('@')
+        # split the list of values from the default value (if present), which
+        # follows the list (values may refer to metrics, e.g. 'AVG(@wall)')
+        at_idx = str.find('@', str.rfind(']'))
         (val, def_val) = (str, None) if at_idx == -1 else (str[:at_idx], str[at_idx+1:]) 
         ret_values = [x.strip() for x in val[val.index('[')+1:val.index(']')].split(',')]
         if def_val:
@@ -19,30 +19,110 @@
 
 from parameter import Parameter, OutOfBoundsExcection
 from copy import deepcopy
-import functools, math
-from util import sobstitute, convert, avg, std, toStr
+import functools, math, re
+from util import sobstitute, convert, toStr
 import os, threading
+import results, stats
+
+# string literals and parameter references ({name}) of a constraint
+CONSTRAIN_TOKEN = re.compile(r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")|\{(\w+)\}""")
+REFERENCE = re.compile(r'\{(\w+)\}')
+
+_literals = {}
+# names the text of a value may refer to (there are no builtins in Python 2)
+LITERAL_NAMES = { '__builtins__': {}, 'True': True, 'False': False, 'None': None }
+
+def literal(value):
+    """ The value of a parameter as it reads once its text is pasted in an 
+    expression (e.g. the string '4' reads as the number 4)
+    
+    >>> literal('4'), literal('False'), literal('None'), literal('-O3')
+    (4, False, None, '-O3')
+    """
+    if isinstance(value, (int, long, float, bool)):
+        return value
+    text = str(value)
+    if text not in _literals:
+        try:
+            _literals[text] = eval(text, dict(LITERAL_NAMES))
+        except Exception:
+            _literals[text] = value
+    return _literals[text]
 
 class Constrain:
+    """ A constraint on the values of the parameters: a Python expression where
+    the parameters are referred as {name}. The expression is compiled once, the
+    references being replaced by the values of the parameters (their text 
+    within string literals).
+    
+    >>> c = Constrain("{block} <= {size} and '{opt}' != '-O0'")
+    >>> sorted(c.names), c.evaluate({'block': 8, 'size': 16, 'opt': '-O3'})
+    (['block', 'opt', 'size'], True)
+    >>> c.evaluate({'block': 32, 'size': 16, 'opt': '-O3'})
+    False
+    >>> [ Constrain(e).evaluate({'flag': 'False'}) for e in ('{flag} == False', 'not {flag}') ]
+    [True, True]
+    """
     def __init__(self, inv):
         self.__constrain = inv
-        
+        self.__compile()
+    
+    def __compile(self):
+        (texts, values) = (set(), set())
+        def replace(m):
+            if m.group(1) is not None:
+                refs = REFERENCE.findall(m.group(1))
+                if not refs:
+                    return m.group(1)
+                texts.update(refs)
+                return "({0}).format(**_text_)".format(m.group(1))
+            values.add(m.group(2))
+            return "_values_[{0!r}]".format(m.group(2))
+        expr = CONSTRAIN_TOKEN.sub(replace, self.__constrain)
+        try:
+            self.__test = eval("lambda _values_, _text_: ({0})".format(expr.strip()), globals())
+        except SyntaxError, err:
+            raise SyntaxError("SyntaxError in constrain '{0}' -> {1}".format(self.__constrain, expr))
+        (self.__texts, self.__values) = (list(texts), list(values))
+        self.__names = frozenset(texts | values)
+    
+    def __getstate__(self):
+        # functions cannot be pickled, the constraint is compiled again
+        return self.__constrain
+    
+    def __setstate__(self, state):
+        self.__constrain = state
+        self.__compile()
+    
     @property
     def constrain(self):
         return self.__constrain
     
+    @property
+    def names(self):
+        """ The parameters referred by the constraint """
+        return self.__names
+    
+    def evaluate(self, values):
+        """ Evaluates the constraint for the values of the parameters in the
+        dictionary 'values' (which must contain all the referred ones) """
+        text = dict([ (name, str(values[name])) for name in self.__texts ])
+        vals = dict([ (name, literal(values[name])) for name in self.__values ])
+        return self.__test(vals, text)
+    
+    def test(self, literals, texts):
+        """ Evaluates the constraint given the literal() and the text of the
+        values of the parameters (avoids converting them at each evaluation) """
+        return self.__test(literals, texts)
+    
     def check(self, conf):
-        try:
-            con = sobstitute(self.__constrain, conf)
-            ret = eval(con)
-            if not ret:
-                print "Failed to satisfy constrain: {0}".format(con)
-        except KeyError, err:
-            # print ("Warning: invariant '{0}' couldn't be checked"
-            #        "for the current configuration.").format(self.__constrain)
+        params = conf.parameters
+        if not self.__names <= set(params.keys()):
+            # the constraint cannot be checked for the current configuration
             return True
-        except SyntaxError, err:
-            raise "SyntaxError in constrain '{0}' -> {1}".format(self.__constrain, con)
+        ret = self.evaluate(dict([ (name, params[name].currValue()) for name in self.__names ]))
+        if not ret:
+            print "Failed to satisfy constrain: {0}".format(sobstitute(self.__constrain, conf))
         return ret
     
     def __str__(self):
@@ -65,12 +145,15 @@ def intersect(param_list):
     return diff
 
 
+# synchronizes the access to the speedup of all the configurations, a
+# configuration does not allocate a condition of its own
+_speedups = threading.Condition()
+
 class Configuration:
     
     def __init__(self):
         self.__parameters = {}
         self.__order = []
-        self.__sync = threading.Condition()
         self.__speedup = None
     
     def __add__(self, conf):
@@ -84,7 +167,7 @@ class Configuration:
         # params = set(self.__parameters.values()[:]) | set(conf.parameters.values()[:])
         for k in self.__order + conf.__order:
             p = self.__parameters[k] if k in self.__order else conf.__parameters[k]
-            ret += deepcopy(p)
+            ret += p
         return ret
     
     def __iadd__(self, param):
@@ -136,25 +219,29 @@ class Configuration:
         return self.__parameters
     
     def getSpeedup(self):
-        self.__sync.acquire()
-        if self.__speedup is None:
-            self.__sync.wait()
-        self.__sync.release()
+        _speedups.acquire()
+        try:
+            while self.__speedup is None:
+                _speedups.wait()
+        finally:
+            _speedups.release()
         return self.__speedup
     
     def setSpeedup(self, val):
-        self.__sync.acquire()
-        self.__speedup = val
-        self.__sync.notify()
-        self.__sync.release()
+        _speedups.acquire()
+        try:
+            self.__speedup = val
+            _speedups.notifyAll()
+        finally:
+            _speedups.release()
     
     def isEvaluated(self):
         return self.__speedup is not None
     
     def __deepcopy__(self, memo):
         ret = Configuration()
-        for p in self.__parameters.values():
-            ret += deepcopy(p)
+        for k in self.__order:
+            ret += self.__parameters[k]
         return ret
         
     def setDefault(self):
@@ -167,12 +254,23 @@ class Configuration:
                 return False
         return True
     
-    def WriteBack(self, def_vals, data, final_out_file, elaborate):
+    def WriteBack(self, def_vals, data, final_out_file, elaborate, failures=None, runs=None, metrics=None,
+                  paired=None):
               
         if elaborate is None:
             return
         
-        self.__sync.acquire()
+        # statuses of the runs which did not terminate successfully
+        failures = failures or []
+        # number of runs executed (when unknown, one for each data row)
+        if runs is None:
+            runs = len(data)
+        # resources used by the runs (see the metrics module)
+        metrics = metrics or []
+        # (default, configuration) average values of the runs executed one 
+        # after the other, when given the speedup is computed from them
+        paired = paired or []
+        
         data = [x for x in data if x is not None]
         data = [x for x in data if len(x)]
         # we remove the empty elements
@@ -180,63 +278,146 @@ class Configuration:
         file_name = sobstitute( elaborate.out_file_name.currValue(), self )
         in_file_format = elaborate.in_file_format
         
+        summary = stats.Summary(data, len(in_file_format))
         res = {}
-        res['MIN'] = [0] * len(in_file_format)
-        res['MAX'] = [0] * len(in_file_format)
-        res['AVG'] = [0] * len(in_file_format)
-        res['STD'] = [0] * len(in_file_format)
+        for function in [ 'MIN', 'MAX', 'AVG', 'STD' ]:
+            res[function] = summary.all(function)
         
-        if len(data):
-            data_ex = zip(*data);
-            for i in range(len(in_file_format)):
-                res['AVG'][i] = avg(data_ex[i])
-                res['MIN'][i] = min(data_ex[i])
-                res['MAX'][i] = max(data_ex[i])
-                
-            for i in range(len(in_file_format)):
-                res['STD'][i] = std(data_ex[i], res['AVG'][i])
-            
-            # print "MINS: " + str(res['MIN'])
-            # print "MAXS: " + str(res['MAX'])
-            # print "AVG : " + str(res['AVG'])
-            # print "STD : " + str(res['STD'])
+        # resources used by the runs, each one is aggregated on its own
+        metric_summaries = {}
         
         vals = []
         for param in elaborate.out_file_format:
+            aggregation = stats.parse(param)
             if param in self.__parameters.keys():
                 vals.append( toStr(self.__parameters[param].currValue()) )
-            elif ( param.startswith('AVG(') or param.startswith('STD(') or 
-                   param.startswith('MIN(') or param.startswith('MAX(') ) and param.endswith(')'):
-                param_name = param[4:-1]
+            elif aggregation and aggregation[2].startswith('@'):
+                (function, arg, name) = (aggregation[0], aggregation[1], aggregation[2][1:])
+                if name not in metric_summaries:
+                    metric_summaries[name] = stats.Summary([ [m[name]] for m in metrics if name in m ], 1)
+                vals.append( toStr(metric_summaries[name].value(function, arg, 0)) )
+            elif aggregation:
+                (function, arg, param_name) = aggregation
                 assert param_name in in_file_format.values
-                vals.append( toStr(res[param[:3]][in_file_format.values.index(param_name)]) )
+                vals.append( toStr(summary.value(function, arg, in_file_format.values.index(param_name))) )
+            elif param == 'RUNS':
+                vals.append( toStr(runs) )
+            elif param == 'FAILURES':
+                vals.append( toStr(len(failures)) )
+            elif param == 'STATUS':
+                vals.append( "|".join(sorted(set(map(lambda x: x.status, failures)))) or 'ok' )
         
-        self.__speedup = -1
+        speedup = -1
         idx = elaborate.speedup_idx.currValue()
         if def_vals:
             if def_vals['AVG'][idx] != 0 and res['AVG'][idx] != 0:
                 assert(idx > 0 or idx < 0)
                 if idx<0:
                     idx = (-idx)-1
-                    self.__speedup = res['AVG'][idx]/def_vals['AVG'][idx]
+                    ratio = lambda default, value: float(value)/default
                 else:
                     idx -= 1
-                    self.__speedup = def_vals['AVG'][idx]/res['AVG'][idx]
+                    ratio = lambda default, value: float(default)/value
+                speedup = ratio(def_vals['AVG'][idx], res['AVG'][idx])
+                # geometric mean of the speedups of the pairs of runs
+                ratios = [ ratio(d[idx], v[idx]) for (d, v) in paired if d[idx] > 0 and v[idx] > 0 ]
+                if ratios:
+                    speedup = math.exp( sum(map(math.log, ratios)) / len(ratios) )
                 
-            vals.append( toStr(self.__speedup) )
+            vals.append( toStr(speedup) )
             
-        open(file_name,'a').write(",".join( vals ) + "\n")
+        results.get().row(file_name, vals)
         
         print "\n{0}".format(80 * "*")
+        if failures:
+            print "* {0} run(s) failed: {1}".format(len(failures), ", ".join(map(str, failures)))
         if res['AVG'][idx] == 0:
             print "* Configuration failed to execute! "
         else:
             print "* Average values: \n*\t%s" %  ", ".join(map(lambda x: "{0:.3f}".format(x), res['AVG']))
-            if self.__speedup != -1:
-                print "* Speedup: \n*\t{0:.5f}".format(self.__speedup) 
+            if speedup != -1:
+                print "* Speedup: \n*\t{0:.5f}".format(speedup) 
         print "{0}".format(80 * "*")
-                
-        self.__sync.notify()
-        self.__sync.release()
+        
+        self.setSpeedup(speedup)
         return res
     
+
+class Schema:
+    """ The parameters of a search space, shared by all its points: a point 
+    only keeps the indices of the values of the parameters, the Configuration
+    object is rebuilt from the schema when needed.
+    
+    >>> conf = Configuration()
+    >>> conf += Parameter('size', [10, 20, 30], 10)
+    >>> conf += Parameter('opt', ['-O2', '-O3'], '-O2')
+    >>> schema = Schema(conf)
+    >>> conf.size.next()
+    20
+    >>> p = schema.point(conf)
+    >>> p, p['size'], p == schema.point(conf)
+    (Point(size=20, opt=-O2), 20, True)
+    >>> p.configuration().size.currValue(), len({ p: 1, schema.point(conf): 2 })
+    (20, 1)
+    """
+    
+    def __init__(self, conf):
+        self.__names = tuple(conf.parameter_keys())
+        self.__params = tuple([ deepcopy(conf.parameters[name]) for name in self.__names ])
+        self.__position = dict([ (name, i) for (i, name) in enumerate(self.__names) ])
+    
+    @property
+    def names(self):
+        return self.__names
+    
+    def __len__(self):
+        return len(self.__names)
+    
+    def point(self, conf):
+        """ The point of the current values of the configuration 'conf' """
+        params = conf.parameters
+        return Point(self, tuple([ params[name].index for name in self.__names ]))
+    
+    def value(self, point, name):
+        idx = point.indices[ self.__position[name] ]
+        param = self.__params[ self.__position[name] ]
+        return param[idx] if idx is not None else param.default
+    
+    def configuration(self, point):
+        """ Builds the Configuration of 'point' """
+        ret = Configuration()
+        for (param, idx) in zip(self.__params, point.indices):
+            ret += param
+            if idx is None:
+                ret.parameters[param.name].resetToDefault()
+            else:
+                ret.parameters[param.name].setValueIdx(idx)
+        return ret
+
+class Point(object):
+    """ A point of the search space of a Schema: the tuple of the indices of 
+    the values of its parameters (None for the default value) """
+    __slots__ = ('schema', 'indices')
+    
+    def __init__(self, schema, indices):
+        self.schema = schema
+        self.indices = indices
+    
+    def __getitem__(self, name):
+        return self.schema.value(self, name)
+    
+    def __hash__(self):
+        return hash(self.indices)
+    
+    def __eq__(self, other):
+        return isinstance(other, Point) and self.schema is other.schema and self.indices == other.indices
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def configuration(self):
+        return self.schema.configuration(self)
+    
+    def __repr__(self):
+        return "Point({0})".format( ", ".join([ "{0}={1}".format(name, self[name]) 
+                                                for name in self.schema.names ]) )
@@ -17,17 +17,7 @@
 
 '''
 
-import os, re, configuration, iterator, config_parse
-
-# substite the parameters which have no alternatives. 
-def do_manual_substitution(cmd, config):
-    prev_cmd = None
-    while cmd != prev_cmd:
-        prev_cmd = cmd
-        for param in config.parameters.values():
-            if len(param) == 1 and cmd.find('{'+param.name+'}') != -1:
-                cmd = cmd.replace('{'+param.name+'}', str(param.currValue()))
-    return cmd
+import os, re, configuration, iterator, config_parse, template
 
 def extract_parameters(cmd):
     p = re.compile('{\w+}')
@@ -55,8 +45,10 @@ class Elaborator:
 
 def elaborate_data(elaborate, config, invariants):
     print ("==== Starting data elaboration ====")
-    # extract the input file name
-    input_file = do_manual_substitution(elaborate.input_file.currValue(), config)
+    # extract the input file name: the parameters which have no alternatives 
+    # are substituted, the references to the other ones are kept
+    fixed = dict([ (p.name, p) for p in config.parameters.values() if len(p) == 1 ])
+    input_file = template.compile(elaborate.input_file.currValue()).render(fixed, partial=True)
     print ("\t*** The skeleton for input files is: %s ***" % input_file) 
     
     dir_skel = os.path.dirname(input_file)
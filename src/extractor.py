@@ -0,0 +1,227 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import re, json
+from util import convert
+from histogram import Histogram
+
+# integer and floating point numbers, optionally signed and with exponent
+NUMBER = '[-+]?\d+(?:\.\d+)?(?:[eE][-+]?\d+)?'
+
+REGEX = 'regex'
+JSON = 'json'
+KEY_VALUE = 'keyvalue'
+
+# samples kept for each run: the first match of the expressions, every match
+# or every match recorded in a histogram (one for each entry of experiment_data)
+FIRST = 'first'
+ALL = 'all'
+HISTOGRAM = 'histogram'
+
+class Extractor:
+    """ Extracts the values listed in 'experiment_data' from the output of a
+    program. With the 'regex' format each entry is a regular expression which
+    precedes the value (a number), unless the expression captures the value
+    itself with a group named 'value'. All the expressions are compiled in a
+    single alternation and the output is scanned once, therefore matches of
+    different expressions cannot overlap.
+    The 'json' (one JSON object per line) and 'keyvalue' (key=value tokens)
+    formats interpret the entries of 'experiment_data' as keys and don't use
+    regular expressions at all.
+
+    >>> e = Extractor(['time:\s+', 'err=(?P<value>\w+)'])
+    >>> e.extract('time: -1.5e3 err=7 time: 4 err=2')
+    [(-1500.0, 7), (4, 2)]
+    >>> Extractor(['time', 'n'], JSON).extract('{"time": 2.5, "n": 3}\\nfoo\\n')
+    [(2.5, 3)]
+    >>> Extractor(['time', 'n'], KEY_VALUE).extract('n=3 time=0.5, other=1')
+    [(0.5, 3)]
+
+    'samples' tells which of the values found in the output of a run are kept
+    (see samples()). """
+
+    def __init__(self, experiment_data, format=REGEX, samples=FIRST):
+        self.__keys = list(experiment_data)
+        self.__format = format
+        self.__samples = samples
+        assert format in (REGEX, JSON, KEY_VALUE), "Unknown extraction format '{0}'".format(format)
+        assert samples in (FIRST, ALL, HISTOGRAM), "Unknown samples mode '{0}'".format(samples)
+        if format == REGEX:
+            self.__regex = re.compile( '|'.join(
+                    [ Extractor.__alternative(i, self.__keys[i]) for i in range(len(self.__keys)) ]) )
+        else:
+            self.__index = dict( [ (self.__keys[i], i) for i in range(len(self.__keys)) ] )
+
+    @staticmethod
+    def __alternative(idx, pattern):
+        # named groups of different patterns must not clash in the alternation
+        pattern = re.sub('\(\?P<(\w+)>', lambda m: '(?P<_{0}_{1}>'.format(idx, m.group(1)), pattern)
+        pattern = re.sub('\(\?P=(\w+)\)', lambda m: '(?P=_{0}_{1})'.format(idx, m.group(1)), pattern)
+        if pattern.find('(?P<_{0}_value>'.format(idx)) == -1:
+            pattern += '(?P<_{0}_value>{1})'.format(idx, NUMBER)
+        return '(?P<_{0}>{1})'.format(idx, pattern)
+
+    def __getstate__(self):
+        # compiled expressions are rebuilt when the extractor is sent to a worker
+        return (self.__keys, self.__format, self.__samples)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def __len__(self):
+        return len(self.__keys)
+
+    @property
+    def lineBased(self):
+        return self.__format != REGEX
+
+    def newRows(self):
+        if self.__samples == HISTOGRAM:
+            return [ Histogram() for k in self.__keys ]
+        return [ [] for k in self.__keys ]
+    
+    def samples(self, rows, runs=1):
+        """ Returns the samples of a run from the values found in its output:
+        with the 'first' mode only the first tuple of values, with 'all' every
+        tuple and with 'histogram' a single tuple of histograms. When the output 
+        comes from several 'runs' the first mode is not applicable (the runs 
+        cannot be told apart) and every tuple is returned. 
+        With the 'all' mode an entry found only once (e.g. printed before the 
+        iterations of the program) is repeated in each tuple. """
+        if self.__samples == HISTOGRAM:
+            return [ tuple(rows) ] if rows and min([ h.count for h in rows ]) else []
+        if self.__samples == ALL and runs == 1 and rows:
+            longest = max(map(len, rows))
+            rows = [ values * longest if len(values) == 1 else values for values in rows ]
+        data = zip(*rows)
+        return data[:1] if self.__samples == FIRST and runs == 1 else data
+
+    def scan(self, text, rows, pos=0, cut=None):
+        """ Appends the values found in 'text' (starting from offset 'pos') to
+        'rows', a list of values for each entry of experiment_data. Only matches
+        ending within offset 'cut' are taken, returns the end of the last match
+        taken and the start of the first match which was left out. """
+        if self.__format == JSON:
+            self.__scanJSON(text, rows)
+        elif self.__format == KEY_VALUE:
+            self.__scanKeyValue(text, rows)
+        if self.lineBased:
+            return (len(text), len(text))
+
+        if cut is None:
+            cut = len(text)
+        for it in self.__regex.finditer(text, pos):
+            if it.end() > cut:
+                # the match may continue after the cut
+                return (pos, it.start())
+            idx = it.lastgroup
+            rows[ int(idx[1:]) ].append( convert(it.group(idx + '_value')) )
+            pos = it.end()
+        return (pos, cut)
+
+    def __scanJSON(self, text, rows):
+        for line in text.splitlines():
+            line = line.strip()
+            if not line.startswith('{'):
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                continue
+            if not isinstance(obj, dict):
+                continue
+            for (key, val) in obj.items():
+                if key in self.__index:
+                    rows[ self.__index[key] ].append( val )
+
+    def __scanKeyValue(self, text, rows):
+        for token in text.replace(',', ' ').split():
+            (key, sep, val) = token.partition('=')
+            if sep and key in self.__index:
+                rows[ self.__index[key] ].append( convert(val) )
+
+    def extract(self, text):
+        """ Returns the values found in 'text' as a list of tuples, the n-th
+        tuple contains the n-th value found for each entry of experiment_data """
+        rows = [ [] for k in self.__keys ]
+        self.scan(text, rows)
+        return zip(*rows)
+
+    def stream(self):
+        return StreamExtractor(self)
+
+def fromSection(extract):
+    """ Builds the extractor for the [Extract] section of the configuration file """
+    format = REGEX
+    if 'format' in extract.parameters.keys():
+        format = extract.format.currValue()
+    samples = FIRST
+    if 'samples' in extract.parameters.keys():
+        samples = extract.samples.currValue()
+    return Extractor(extract.experiment_data.values, format, samples)
+
+class StreamExtractor:
+    """ Incremental version of Extractor.extract(): the output of a program is
+    fed chunk by chunk and only the (incomplete) last line is kept in memory.
+    Matches which span the boundary of a chunk are completed once the following
+    chunk arrives. """
+
+    # text already scanned which is kept to match patterns spanning lines
+    OVERLAP = 4 * 1024
+    # lines longer than this are scanned without waiting for their end
+    MAX_LINE = 1024 * 1024
+
+    def __init__(self, extractor):
+        self.__extractor = extractor
+        self.__rows = extractor.newRows()
+        self.__tail = ''
+
+    def feed(self, chunk):
+        buf = self.__tail + chunk
+        cut = buf.rfind('\n') + 1
+        if cut == 0:
+            if len(buf) < StreamExtractor.MAX_LINE or self.__extractor.lineBased:
+                self.__tail = buf
+                return
+            cut = len(buf) - StreamExtractor.OVERLAP
+        if self.__extractor.lineBased:
+            self.__extractor.scan(buf[:cut], self.__rows)
+            self.__tail = buf[cut:]
+            return
+        (pos, keep) = self.__extractor.scan(buf, self.__rows, 0, cut)
+        # the text after the last match is kept, up to OVERLAP bytes before
+        # the cut, for the matches which span multiple lines
+        self.__tail = buf[ min(keep, max(pos, cut - StreamExtractor.OVERLAP)): ]
+
+    def close(self, runs=1):
+        """ Scans the remaining output and returns the samples of the 'runs' 
+        which produced it (see Extractor.samples()) """
+        self.__extractor.scan(self.__tail, self.__rows)
+        self.__tail = ''
+        return self.__extractor.samples(self.__rows, runs)
+
+def extract_file(file_name, extractor, chunk_size=64*1024, runs=None):
+    """ Returns the samples found in 'file_name', the output of one or more
+    runs (unknown when None) """
+    stream = extractor.stream()
+    f = open(file_name, 'rb')
+    for chunk in iter(lambda: f.read(chunk_size), ''):
+        stream.feed(chunk)
+    f.close()
+    return stream.close(runs)
@@ -0,0 +1,177 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import math, random
+from copy import deepcopy
+from configuration import Schema, Point
+from parameter import Parameter
+
+def pin(conf, name, value):
+    """ Replaces the parameter 'name' of 'conf' with one having the single
+    value 'value', so that it is no longer iterated but can still be referred
+    by the templates
+    
+    >>> from configuration import Configuration
+    >>> from iterator import ConfigIterator
+    >>> from util import sobstitute
+    >>> conf = Configuration()
+    >>> for p in [ Parameter('n', [1, 2, 3], 1), Parameter('file_name', ['out_{n}.txt'], 'out_{n}.txt') ]:
+    ...     conf += p
+    >>> pin(conf, 'n', 3)
+    >>> [ sobstitute('{file_name}', c) for c in ConfigIterator(conf, []) ]
+    ['out_3.txt']
+    """
+    conf -= conf.parameters[name]
+    conf += Parameter(name, [ value ], value)
+
+def budgets(num_of_runs, eta=3, min_runs=1):
+    """ The numbers of runs of the rungs of a search whose full evaluation 
+    takes 'num_of_runs' runs: from 'min_runs', growing by about 'eta'
+    
+    >>> budgets(10, 3), budgets(27, 3), budgets(100, 3, 2)
+    ([1, 3, 10], [1, 3, 9, 27], [2, 4, 11, 33, 100])
+    """
+    if num_of_runs <= min_runs:
+        return [ num_of_runs ]
+    k = int(math.ceil(math.log(float(num_of_runs) / min_runs) / math.log(eta) - 1e-9))
+    return sorted(set([ max(min_runs, int(round(num_of_runs / float(eta) ** i))) for i in range(k, -1, -1) ]))
+
+class SuccessiveHalving:
+    """ Multi-fidelity search of the parameters of 'config': the values of the
+    'fidelity' parameter are the budgets of the rungs, from the cheapest to 
+    the full one (e.g. the number of runs, or growing input sizes). 
+    'configurations' random configurations are evaluated with the cheapest 
+    budget, the best 1/'eta' of them (by speedup) are evaluated again with 
+    the next one, and so on up to the full budget. 
+    With 'hyperband' the search is repeated by brackets which start from
+    more expensive rungs with fewer configurations (the most aggressive 
+    bracket first), so that a budget which is too small to rank the
+    configurations does not discard the good ones. A configuration is
+    evaluated once for each budget. 
+    
+    >>> from configuration import Configuration
+    >>> from iterator import ConfigIterator
+    >>> from util import sobstitute
+    >>> main = Configuration()
+    >>> for p in [ Parameter('n', [1, 2, 3], 1), Parameter('file_name', ['out_{n}.txt'], 'out_{n}.txt') ]:
+    ...     main += p
+    >>> fidelity = Parameter('n', list(main.n), 3)
+    >>> pin(main, 'n', 3)
+    >>> opt = Configuration()
+    >>> opt += Parameter('x', range(9), 0)
+    >>> rendered = []
+    >>> def evaluate(confs, budget):
+    ...     for parent in ConfigIterator(main, []):
+    ...         pin(parent, 'n', budget.currValue())
+    ...         for conf in confs:
+    ...             rendered.append( sobstitute('{file_name}', parent + conf) )
+    ...             conf.setSpeedup( conf.x.currValue() )
+    >>> (best, speedup) = SuccessiveHalving(opt, [], fidelity, 9, 3).run(evaluate) # doctest: +ELLIPSIS
+    #...
+    * SuccessiveHalving: best speedup 8.00000 of Point(x=8)
+    >>> [ rendered.count('out_{0}.txt'.format(n)) for n in [ 1, 2, 3 ] ], best.x.currValue()
+    ([9, 3, 1], 8)
+    """
+    
+    def __init__(self, config, constraints, fidelity, configurations=81, eta=3, hyperband=False, seed=-1):
+        self.__config = config
+        self.__constraints = constraints
+        self.__fidelity = fidelity
+        self.__configurations = configurations
+        self.__eta = max(2, eta)
+        self.__hyperband = hyperband
+        self.__seed = seed
+    
+    def brackets(self):
+        """ The (number of configurations, first rung) of each bracket 
+        
+        >>> sh = SuccessiveHalving(None, [], Parameter('num_of_runs', [1, 3, 9], 9), 27, 3, True)
+        >>> sh.brackets()
+        [(27, 0), (14, 1), (9, 2)]
+        """
+        last = len(self.__fidelity) - 1
+        if not self.__hyperband:
+            return [ (self.__configurations, 0) ]
+        return [ (int(math.ceil(self.__configurations * (last + 1.0) / (s + 1) / self.__eta ** (last - s))), 
+                  last - s) for s in range(last, -1, -1) ]
+    
+    def __sample(self, schema, n):
+        # 'n' distinct feasible points, all of them when the space is smaller
+        params = [ self.__config.parameters[name] for name in schema.names ]
+        size = reduce(lambda x, y: x * y, [ max(1, len(p)) for p in params ], 1)
+        points = []
+        if size <= n:
+            candidates = [ tuple(idx) for idx in self.__enumerate(params) ]
+        else:
+            candidates = ( tuple([ random.randint(0, len(p)-1) if len(p) else None for p in params ]) 
+                            for attempt in xrange(1000 * n) )
+        seen = set()
+        for indices in candidates:
+            if indices in seen:
+                continue
+            seen.add(indices)
+            point = Point(schema, indices)
+            if point.configuration().check(self.__constraints):
+                points.append( point )
+                if len(points) == n:
+                    break
+        return points
+    
+    def __enumerate(self, params):
+        ret = [ [] ]
+        for p in params:
+            ret = [ idx + [ i ] for idx in ret for i in (range(len(p)) if len(p) else [ None ]) ]
+        return ret
+    
+    def run(self, evaluate):
+        """ Executes the search: 'evaluate(confs, budget)' evaluates the list
+        of configurations 'confs', setting their speedup, with the budget of 
+        the value of 'budget' (a copy of the fidelity parameter). Returns the best configuration evaluated with the full budget and its
+        speedup """
+        if self.__seed != -1:
+            random.seed(self.__seed)
+        schema = Schema(self.__config)
+        name = self.__fidelity.name
+        last = len(self.__fidelity) - 1
+        # speedup of the points evaluated so far, by (point, rung)
+        known = {}
+        for (b, (n, first)) in enumerate(self.brackets()):
+            points = self.__sample(schema, n)
+            for rung in range(first, last + 1):
+                print  '#{0}#'.format('-' * 78)
+                print ("#    SuccessiveHalving: bracket {0}, rung {1}: {2} configurations with {3}={4}".
+                        format(b+1, rung+1, len(points), name, self.__fidelity[rung]))
+                print  '#{0}#'.format('-' * 78)
+                pending = [ (p, p.configuration()) for p in points if (p, rung) not in known ]
+                if pending:
+                    fidelity = deepcopy(self.__fidelity)
+                    fidelity.setValueIdx(rung)
+                    evaluate([ conf for (_, conf) in pending ], fidelity)
+                    for (p, conf) in pending:
+                        known[(p, rung)] = conf.getSpeedup()
+                if rung < last:
+                    points = sorted(points, key=lambda p: known[(p, rung)], reverse=True)
+                    points = points[:max(1, len(points) // self.__eta)]
+        
+        full = [ (speedup, p) for ((p, rung), speedup) in known.items() if rung == last ]
+        if not full:
+            return (None, None)
+        best = max(full, key=lambda (speedup, p): speedup)
+        print ("* SuccessiveHalving: best speedup {0:.5f} of {1}".format(best[0], best[1]))
+        return (best[1].configuration(), best[0])
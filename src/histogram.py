@@ -0,0 +1,177 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import math
+from util import convert
+
+# number of bits of the sub-buckets of each power of two, the values recorded
+# in a histogram are approximated within a relative error of 2^-(PRECISION+1)
+PRECISION = 7
+
+class Histogram:
+    """ Distribution of the values of a column, HDR style: each power of two
+    is split in 2^precision linear buckets and only the count of the values
+    falling in each bucket is kept, so the size of the histogram depends on
+    the range of the values and not on their number. Count, sum, minimum and
+    maximum are exact, percentiles are approximated by the center of the
+    buckets.
+
+    >>> h = Histogram()
+    >>> for v in range(1, 1001): h.append(v / 1000.0)
+    >>> h.count, h.min, h.max, '{0:.4f}'.format(h.mean())
+    (1000, 0.001, 1.0, '0.5005')
+    >>> abs(h.percentile(99) - 0.99) < 0.99 / 2**PRECISION
+    True
+    >>> parse(str(h)).percentile(50) == h.percentile(50)
+    True
+    """
+
+    def __init__(self, precision=PRECISION):
+        self.precision = precision
+        self.count = 0
+        self.total = 0.0
+        self.squares = 0.0
+        self.min = None
+        self.max = None
+        # counts of the buckets of the positive and negative values
+        self.buckets = {}
+        self.negative = {}
+        self.zeros = 0
+
+    def __index(self, value):
+        (m, e) = math.frexp(value)
+        return (e << self.precision) + int((m - 0.5) * (2 << self.precision))
+
+    def __center(self, idx):
+        (e, sub) = (idx >> self.precision, idx & ((1 << self.precision) - 1))
+        return math.ldexp(0.5 + (sub + 0.5) / (2 << self.precision), e)
+
+    def append(self, value):
+        """ Records 'value' (the histogram can replace a list of values) """
+        self.count += 1
+        self.total += value
+        self.squares += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        if value > 0:
+            idx = self.__index(value)
+            self.buckets[idx] = self.buckets.get(idx, 0) + 1
+        elif value < 0:
+            idx = self.__index(-value)
+            self.negative[idx] = self.negative.get(idx, 0) + 1
+        else:
+            self.zeros += 1
+
+    def merge(self, other):
+        assert self.precision == other.precision
+        self.count += other.count
+        self.total += other.total
+        self.squares += other.squares
+        for v in (other.min, other.max):
+            if v is not None:
+                self.min = v if self.min is None else min(self.min, v)
+                self.max = v if self.max is None else max(self.max, v)
+        for (mine, theirs) in ((self.buckets, other.buckets), (self.negative, other.negative)):
+            for (idx, n) in theirs.items():
+                mine[idx] = mine.get(idx, 0) + n
+        self.zeros += other.zeros
+        return self
+
+    def __values(self):
+        # (representative value, count) of the buckets in increasing order
+        for idx in sorted(self.negative.keys(), reverse=True):
+            yield (-self.__center(idx), self.negative[idx])
+        if self.zeros:
+            yield (0.0, self.zeros)
+        for idx in sorted(self.buckets.keys()):
+            yield (self.__center(idx), self.buckets[idx])
+
+    def mean(self):
+        return self.total / self.count if self.count else 0
+
+    def std(self):
+        if not self.count:
+            return 0
+        return math.sqrt( max(0.0, self.squares / self.count - self.mean() ** 2) )
+
+    def percentile(self, p):
+        if not self.count:
+            return 0
+        rank = p / 100.0 * (self.count - 1)
+        seen = 0
+        for (value, n) in self.__values():
+            seen += n
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def geomean(self):
+        if not self.count or self.min <= 0:
+            return 0.0
+        return math.exp( sum([ n * math.log(value) for (value, n) in self.__values() ]) / self.count )
+
+    def trimmedMean(self, p):
+        cut = int(self.count * p / 100.0)
+        if cut * 2 >= self.count:
+            return self.mean()
+        (acc, seen) = (0.0, 0)
+        for (value, n) in self.__values():
+            # the part of the bucket between the cut at each end
+            taken = max(0, min(seen + n, self.count - cut) - max(seen, cut))
+            acc += taken * value
+            seen += n
+        return acc / (self.count - 2 * cut)
+
+    def __format__(self, spec):
+        return "{0:{1}} (n={2})".format(self.mean(), spec, self.count)
+
+    def __str__(self):
+        # compact encoding, without commas so that it fits in a CSV field
+        buckets = lambda b: ";".join([ "{0}x{1}".format(idx, n) for (idx, n) in sorted(b.items()) ])
+        return "H{0}:{1}:{2!r}:{3!r}:{4!r}:{5!r}:{6}:{7}:{8}".format(self.precision, self.count,
+                self.total, self.squares, self.min, self.max, self.zeros,
+                buckets(self.buckets), buckets(self.negative))
+
+def parse(text):
+    """ Rebuilds the histogram encoded by str() """
+    fields = text[1:].split(':')
+    h = Histogram(int(fields[0]))
+    h.count = int(fields[1])
+    (h.total, h.squares) = (float(fields[2]), float(fields[3]))
+    (h.min, h.max) = [ None if v == 'None' else convert(v) for v in fields[4:6] ]
+    h.zeros = int(fields[6])
+    for (dest, items) in ((h.buckets, fields[7]), (h.negative, fields[8])):
+        for item in items.split(';'):
+            if item:
+                (idx, n) = item.split('x')
+                dest[int(idx)] = int(n)
+    return h
+
+def decode(value):
+    """ Converts a value read back from a results file, which can be the
+    encoding of a histogram """
+    if isinstance(value, basestring) and value.startswith('H'):
+        return parse(value)
+    return convert(value) if isinstance(value, basestring) else value
+
+def encode(value):
+    # values stored as JSON (cache and journal)
+    return str(value) if isinstance(value, Histogram) else value
@@ -0,0 +1,152 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, glob, threading
+import template
+from util import sobstitute
+from runner import prepare_command, run_pack
+
+def references(text, conf):
+    """ Names of the parameters of 'conf' the template 'text' refers, directly
+    or through the values of other parameters
+
+    >>> from configuration import Configuration
+    >>> from parameter import Parameter
+    >>> conf = Configuration()
+    >>> for p in [ Parameter('opt', [0, 2], 0), Parameter('n', [1, 2], 1),
+    ...            Parameter('bin', ['prog_{opt}'], 'prog_{opt}') ]: conf += p
+    >>> sorted( references('gcc -O{opt} -o {bin} prog.c', conf) )
+    ['bin', 'opt']
+    """
+    params = conf.parameters
+    (names, pending) = (set(), [ text ])
+    while pending:
+        for name in template.compile(pending.pop()).names:
+            if name in params and name not in names:
+                names.add(name)
+                pending += [ v for v in list(params[name]) + [ params[name].default ]
+                                if isinstance(v, basestring) and '{' in v ]
+    return names
+
+def files(text):
+    # the files listed by 'text' (shell patterns are expanded)
+    ret = []
+    for name in text.split():
+        ret += sorted(glob.glob(name)) if glob.has_magic(name) else [ name ]
+    return ret
+
+class Step:
+    """ An initialization command rendered for a set of values of the
+    parameters it refers ('key'), to be executed after the steps it 'depends'
+    on """
+
+    def __init__(self, index, key, cmd, out_file, inputs, outputs):
+        self.index = index
+        self.key = key
+        self.cmd = cmd
+        self.out_file = out_file
+        self.inputs = inputs
+        self.outputs = outputs
+        self.depends = []
+
+    def upToDate(self):
+        """ True when the declared outputs exist and none of them is older than
+        the declared inputs """
+        if not self.outputs:
+            return False
+        try:
+            outputs = [ os.path.getmtime(f) for f in files(self.outputs) ]
+            inputs = [ os.path.getmtime(f) for f in files(self.inputs) ]
+        except OSError:
+            return False
+        return len(outputs) > 0 and min(outputs) >= max(inputs or [ 0 ])
+
+    def execute(self):
+        if self.upToDate():
+            print "* Up to date, skipping: {0}".format(self.cmd)
+            return
+        run_pack([ (self.cmd, self.out_file) ], 1, None, None, False)
+
+class Initializer:
+    """ Executes the 'initialize' commands for the configurations of the main
+    benchmark. Each command is rendered only with the parameters it refers,
+    therefore it is executed once for each distinct combination of their
+    values (e.g. a build depending on {opt_level} is not repeated for every
+    input size). The command with index i, the 'inputs' and 'outputs' with the
+    same index (files, possibly shell patterns) are declared, is skipped when
+    its outputs are newer than its inputs.
+    A step depends on the steps of the previous commands which agree on the
+    values of the parameters they have in common (on all of them when there
+    is none), independent steps are executed by up to 'jobs' threads. """
+
+    def __init__(self, conf_iter, cmd_list, inputs=None, outputs=None):
+        self.steps = []
+        conf = conf_iter.configuration
+        inputs = list(inputs or [])
+        outputs = list(outputs or [])
+        templates = []
+        for (i, cmd) in enumerate(cmd_list):
+            declared = [ d[i] if i < len(d) and d[i] not in (None, '', '-') else '' for d in (inputs, outputs) ]
+            names = references(" ".join([ cmd ] + declared), conf)
+            templates.append( (cmd, sorted(names), declared) )
+
+        seen = {}
+        for curr_conf in conf_iter:
+            for (i, (cmd, names, declared)) in enumerate(templates):
+                key = tuple([ curr_conf.parameters[name].currValue() for name in names ])
+                if (i, key) in seen:
+                    continue
+                (curr_cmd, out_file) = prepare_command(cmd, curr_conf)
+                (ins, outs) = [ sobstitute(d, curr_conf) for d in declared ]
+                step = Step(i, dict(zip(names, key)), curr_cmd, out_file, ins, outs)
+                step.depends = [ other for other in self.steps if other.index < i and
+                                    all([ other.key[n] == step.key[n] for n in names if n in other.key ]) ]
+                seen[(i, key)] = step
+                self.steps.append( step )
+
+    def run(self, jobs=1):
+        """ Executes the steps, in the order of the iteration when 'jobs' is 1 """
+        if jobs <= 1:
+            for step in self.steps:
+                step.execute()
+            return
+
+        (pending, done, running) = (list(self.steps), set(), [ 0 ])
+        cond = threading.Condition()
+        def work(step):
+            try:
+                step.execute()
+            finally:
+                cond.acquire()
+                done.add(step)
+                running[0] -= 1
+                cond.notify()
+                cond.release()
+
+        cond.acquire()
+        while pending:
+            ready = [ step for step in pending if all([ d in done for d in step.depends ]) ]
+            for step in ready[:jobs - running[0]]:
+                pending.remove(step)
+                running[0] += 1
+                threading.Thread(target=work, args=(step,)).start()
+            cond.wait()
+        while running[0]:
+            cond.wait()
+        cond.release()
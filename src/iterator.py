@@ -18,9 +18,16 @@
 '''
 
 from parameter import Parameter, OutOfBoundsExcection
-from configuration import Configuration, Constrain
-from util import toStr
-import math
+from configuration import Configuration, Constrain, Schema, literal
+from util import toStr, convert
+from copy import deepcopy
+import math, os, json
+
+try:
+    import numpy
+except ImportError:
+    # the candidates of the Bayesian search are scored one by one
+    numpy = None
 
 class ConfigIterator:
     
@@ -42,23 +49,51 @@ class ConfigIterator:
         pass
         
     def next(self):
-        if self.__config.check(self.__invariants):
-            yield self.__config
-        keys = [k for k in self.__config.parameters.keys()]
-        while True:
-            k = 0
-            overflow = True
-            while k < len(keys) and overflow:
-                try:
-                    self.__config.parameters[keys[k]].next()
-                    overflow = False
-                except OutOfBoundsExcection:
-                    self.__config.parameters[keys[k]].reset()
-                    k += 1
-            if k == len(keys):
-                raise StopIteration
-            if self.__config.check(self.__invariants):
+        """ Enumerates the cartesian product of the values of the parameters 
+        (the first parameter changing fastest) depth first. Each constraint is 
+        checked as soon as the parameters it refers are set, so that the 
+        assignments of the remaining parameters are skipped altogether when it 
+        is not satisfied. """
+        params = self.__config.parameters
+        # the parameters without a list of values keep their default value
+        levels = [ params[k] for k in reversed(params.keys()) if len(params[k]) ]
+        depth = dict([ (p.name, i) for (i, p) in enumerate(levels) ])
+        # constraints checked once the parameter of each level is set (the
+        # first entry for the constraints on fixed parameters only)
+        checks = [ [] for i in range(len(levels)+1) ]
+        for inv in self.__invariants:
+            if inv.names <= set(params.keys()):
+                checks[ max([ depth.get(name, -1) for name in inv.names ] + [-1]) + 1 ].append(inv)
+        # values of the fixed parameters referred by the constraints, the
+        # others are set while visiting their level
+        fixed = [ name for invs in checks for inv in invs for name in inv.names if name not in depth ]
+        literals = dict([ (k, literal(params[k].currValue())) for k in fixed ])
+        texts = dict([ (k, str(params[k].currValue())) for k in fixed ])
+        # the values of each level, converted once
+        choices = [ [ (idx, literal(p[idx]), str(p[idx])) for idx in range(len(p)) ] for p in levels ]
+        
+        def visit(level):
+            if level == len(levels):
                 yield self.__config
+                return
+            (param, name, level_checks) = (levels[level], levels[level].name, checks[level+1])
+            for (idx, lit, text) in choices[level]:
+                (literals[name], texts[name]) = (lit, text)
+                for inv in level_checks:
+                    if not inv.test(literals, texts):
+                        break
+                else:
+                    param.setValueIdx(idx)
+                    for conf in visit(level+1):
+                        yield conf
+        
+        for inv in checks[0]:
+            if not inv.test(literals, texts):
+                raise StopIteration
+        for conf in visit(0):
+            yield conf
+        for param in levels:
+            param.reset()
 
 class SingleConfIterator:
     def __init__(self, config):
@@ -89,8 +124,6 @@ class RandConfigIterator:
         self.__constraints = constraints
         self.__iterations = iterations
         self.__seed = seed
-        if self.__seed == -1:
-            random.seed(None)
         self.__currIt = 0
     
     @property
@@ -188,7 +221,7 @@ class CompoundConfigIterator:
 # Genetic Search Algorithm
 class GeneticSearchIterator:
     
-    def __init__(self, config, constraints, log_file, genetic_conf, seed=-1):
+    def __init__(self, config, constraints, log_file, genetic_conf, seed=-1, fitness_file=None):
         self.__config = config
         self.__constraints = constraints
         self.__log_file = log_file
@@ -201,8 +234,22 @@ class GeneticSearchIterator:
         self.__iterations = genetic_conf.iterations.currValue()
         self.__repeatitions = genetic_conf.repeatitions.currValue()
         self.__seed = seed
-        if self.__seed == -1:
-            random.seed(None)
+        # number of individuals of the initial population taken from the best
+        # genomes evaluated so far
+        self.__seed_best = 0
+        if 'seed_best' in genetic_conf.parameters.keys():
+            self.__seed_best = genetic_conf.seed_best.currValue()
+        
+        # fitness of each genome evaluated so far, kept across generations and
+        # repetitions, and across executions when stored onto 'fitness_file'
+        self.__fitness = {}
+        self.__fitness_file = fitness_file
+        if fitness_file and os.path.exists(fitness_file):
+            for line in open(fitness_file):
+                if line.strip():
+                    record = json.loads(line)
+                    self.__fitness[ tuple(map(tuple, record['genome'])) ] = record['fitness']
+            print "[Genetic Search]\n-> {0} genomes read from: {1}".format(len(self.__fitness), fitness_file)
     
     @property
     def configuration(self):
@@ -217,6 +264,17 @@ class GeneticSearchIterator:
     def reset(self):
         print "[Genetic Search]\n-> Initializing population of size: %s" % self.__pop_size 
         self.__pop = []
+        best = sorted(self.__fitness.items(), key=lambda (genome, fitness): fitness, reverse=True)
+        for (genome, fitness) in best:
+            if len(self.__pop) >= min(self.__seed_best, self.__pop_size):
+                break
+            element = self.__element(genome)
+            if element is not None:
+                element.setSpeedup(fitness)
+                self.__pop.append(element)
+        if self.__pop:
+            print "-> {0} individuals taken from the best genomes evaluated so far".format(len(self.__pop))
+        
         # vector of still unused parameters
         # this is done to avoid to have some of the parameters out of the first population
         unused_params = [param for param in self.__config.parameters.values()]
@@ -305,6 +363,76 @@ class GeneticSearchIterator:
             
         return tuple(offsprings)
     
+    def genome(self, element):
+        """ Canonical key of the configuration evaluated for 'element' (which 
+        must hold all the parameters) """
+        return tuple([ (name, element.parameters[name].currValue()) for name in sorted(element.parameter_keys()) ])
+    
+    def __element(self, genome):
+        # the individual with the values of 'genome', None when they are not
+        # valid values of the parameters (anymore)
+        element = Configuration()
+        for (name, value) in genome:
+            param = self.__config.parameters.get(name)
+            if param is None or (value not in list(param) and value != param.default):
+                return None
+            element += param
+            element.parameters[name].setValue(value)
+        if len(element) != len(self.__config) or not element.check(self.__constraints):
+            return None
+        return element
+    
+    def __evaluate(self, batch, generation_number):
+        # yields the individuals of 'batch' at once, so that they are evaluated
+        # concurrently by the runners which can do so, then waits for their 
+        # fitness. Genomes already evaluated are not yielded again: the known
+        # fitness is used, or the one of the duplicate in the same batch
+        count = 1
+        (evaluated, order, duplicates) = ({}, [], [])
+        for element in batch:
+            print  '#{0}#'.format('-' * 78)
+            print ("#    GeneticSearch: evaluating generation {0} (element {1}/{2})".\
+                    format(generation_number, count, len(batch)))
+            print  '#{0}#'.format('-' * 78)
+            
+            print "{0}".format(element)
+            
+            count += 1
+            
+            # set other parameters to default otherwise the runner is not able to run the configuration
+            added_params = []
+            for param in self.__config.parameters.values():
+                if param.name not in element.parameter_keys():
+                    element += param
+                    added_params.append(param)
+            
+            genome = self.genome(element)
+            if genome in self.__fitness:
+                print "\t* Genome already evaluated, fitness = {0:.5f} *".format(self.__fitness[genome])
+                element.setSpeedup( self.__fitness[genome] )
+            elif genome in evaluated:
+                print "\t* Genome evaluated by another individual of this generation *"
+                duplicates.append( (element, evaluated[genome]) )
+            elif element.check(self.__constraints):
+                evaluated[genome] = element
+                order.append( genome )
+                yield element
+            else:
+                # element failed
+                element.setSpeedup(-1)
+                
+            for param in added_params:
+                element -= param
+        
+        records = []
+        for genome in order:
+            self.__fitness[genome] = evaluated[genome].getSpeedup()
+            records.append( json.dumps({ 'genome': genome, 'fitness': self.__fitness[genome] }) + "\n" )
+        for (element, other) in duplicates:
+            element.setSpeedup( other.getSpeedup() )
+        if self.__fitness_file and records:
+            open(self.__fitness_file, 'a').write( "".join(records) )
+    
     def next(self):
         repeatitions = 1;
         while( repeatitions < self.__repeatitions):
@@ -313,121 +441,401 @@ class GeneticSearchIterator:
             max_fitness = None
             max_generation = 0
             open(self.__log_file, 'a').write('@ Genetich search start: {0}\n'.format(repeatitions))
+            # number of tournaments played by each generation: each tournament 
+            # replaces two individuals with its (not yet evaluated) offsprings, 
+            # the following ones must still find enough evaluated individuals
+            tournaments = max(1, (self.__pop_size - self.__tournament_size) // 2 + 1)
             while generation_number < self.__iterations or (generation_number - max_generation) < 10:
-                # generate a tournament
-                
-                toEvaluate = [ self.__pop.index(x) for x in self.__pop if not x.isEvaluated() ]
-                # collect configurations which have not been evaluated yet
+                # the individuals which have not been evaluated yet (the whole 
+                # population at first, then the offsprings of the previous 
+                # generation) are handed to the runner together, then their 
+                # fitness is awaited
+                batch = [ x for x in self.__pop if not x.isEvaluated() ]
                 print '#{0}#'.format('*' * 78) 
-                print "#    Starting new tournament"
-                print '#       # of configurations not yet evaluated: %s' % len(toEvaluate)
-                    
-                tournament = set()
-                while len(tournament) < self.__tournament_size:
-                    if len(toEvaluate) > 0:
-                        n = random.randint(0,len(toEvaluate)-1)
-                        tournament.add( self.__pop[toEvaluate[n]] )
-                        del toEvaluate[n]
-                    else:
-                        tournament.add( self.__pop[random.randint(0,self.__pop_size-1)] )
-                # we created a tournament, now we evaluate the elements in the tournament
-                # print 'Population: [ {0} ]'.format( ', '.join( map(lambda x: '{0}'.format(x.isEvaluated()), self.__pop) ) )
-                count = 1
+                print "#    Starting new generation"
+                print '#       # of configurations not yet evaluated: %s' % len(batch)
+                for element in self.__evaluate(batch, generation_number):
+                    yield element
                 
-                for element in tournament:
-                    print  '#{0}#'.format('-' * 78)
-                    print ("#    GeneticSearch: evaluating generation {0} (element {1}/{2})".\
-                            format(generation_number, count, self.__tournament_size))
-                    print  '#{0}#'.format('-' * 78)
-                    
-                    print "{0}".format(element)
-                    
-                    count += 1
+                for t in range(tournaments):
+                    if generation_number >= self.__iterations and (generation_number - max_generation) >= 10:
+                        break
+                    # the tournament is drawn among the evaluated individuals
+                    evaluated = [ x for x in self.__pop if x.isEvaluated() ]
+                    tournament = random.sample(evaluated, min(self.__tournament_size, len(evaluated)))
+                    print '#{0}#'.format('*' * 78) 
+                    print "#    Starting new tournament (generation {0})".format(generation_number)
+                    for element in tournament:
+                        print "{0}".format(element)
                     
-                    if element.isEvaluated():
-                        print "\t* Configuration already evaluated *"
-                        continue
+                    # printing fitness values
+                    tournament = sorted(tournament, key=lambda element: element.getSpeedup(), reverse=True)
+                    print  '#{0}#'.format('~' * 78)
+                    print '#    Fitness values for the tournament:\n#\t[ {0} ]'.\
+                        format( ', '.join(map(lambda element: '{0:.5f}'.format(element.getSpeedup()),tournament)) )
+                    print '#'
+                    tournament_max = tournament[0].getSpeedup()
+                    if max_fitness is None or max_fitness < tournament_max:
+                        max_fitness = tournament_max
+                        max_generation = generation_number
                         
-                    # set other parameters to default otherwise the runner is not able to run the configuration
-                    added_params = []
-                    for param in self.__config.parameters.values():
-                        if param.name not in element.parameter_keys():
-                            element += param
-                            added_params.append(param)
+                    # Log the outcome of this tournament
+                    vals = []
+                    for param in self.__log_file_format:
+                        if param in element.parameter_keys():
+                            vals.append( toStr(element.parameters[param].currValue()) )
+                        else:
+                            vals.append( '-' )
+                    # adding the value of the maximum fitness for this generation
+                    vals.append( '{0:.5f}'.format(tournament_max) )
+                    open(self.__log_file,'a').write(",".join( vals ) + "\n")
                     
-                    if element.check(self.__constraints):
-                        yield element
-                    else:
-                        # element failed
-                        element.setSpeedup(-1)
-                        
-                    for param in added_params:
-                        element -= param
-                
-                # evaluation of tournament completed, printing fitness values
-                tournament = sorted(tournament, key=lambda element: element.getSpeedup(), reverse=True)
-                print  '#{0}#'.format('~' * 78)
-                print '#    Fitness values for the tournament:\n#\t[ {0} ]'.\
-                    format( ', '.join(map(lambda element: '{0:.5f}'.format(element.getSpeedup()),tournament)) )
-                print '#'
-                tournament_max = tournament[0].getSpeedup()
-                if max_fitness is None or max_fitness < tournament_max:
-                    max_fitness = tournament_max
-                    max_generation = generation_number
-                    
-                # Log the outcome of this tournament
-                vals = []
-                for param in self.__log_file_format:
-                    if param in element.parameter_keys():
-                        vals.append( toStr(element.parameters[param].currValue()) )
-                    else:
-                        vals.append( '-' )
-                # adding the value of the maximum fitness for this generation
-                vals.append( '{0:.5f}'.format(tournament_max) )
-                open(self.__log_file,'a').write(",".join( vals ) + "\n")
-                    
-                # print "##### PARENTS #####"
-                # print '{0}'.format(tournament[0])
-                # print '{0}'.format(tournament[1])
-                (offspring1, offspring2) = self.crossover(tournament[0], tournament[1])
-                # print '{0}'.format(offspring1)
-                # print '{0}'.format(offspring2)
-                if random.random() <= 0.2 or tournament[0] == tournament[1]:
-                    # Mutation:
-                    # in order to avoid to get stuck in a local maximal, we apply mutation
-                    print '#    Applying mutation on newly created offsprings'
-                    for offspring in (offspring1, offspring2):
-                        for param in offspring.parameters.values():
-                            if random.randint(0, 1):
-                                param.rand()
+                    # print "##### PARENTS #####"
+                    # print '{0}'.format(tournament[0])
+                    # print '{0}'.format(tournament[1])
+                    (offspring1, offspring2) = self.crossover(tournament[0], tournament[1])
+                    # print '{0}'.format(offspring1)
+                    # print '{0}'.format(offspring2)
+                    if random.random() <= 0.2 or tournament[0] == tournament[1]:
+                        # Mutation:
+                        # in order to avoid to get stuck in a local maximal, we apply mutation
+                        print '#    Applying mutation on newly created offsprings'
+                        for offspring in (offspring1, offspring2):
+                            for param in offspring.parameters.values():
+                                if random.randint(0, 1):
+                                    param.rand()
                                 
-                        if random.randint(0, 1) and len(offspring) < len(self.__config):
-                            print "#\t-> Adding paraleter to configuration"
-                            # we add a new parameter to this configuration
-                            found = False
-                            while not found:
-                                idx = random.randint(0,len(self.__config)-1)
-                                param = self.__config.parameters[self.__config.parameter_keys()[idx]]
-                                if param.name not in offspring.parameter_keys():
-                                    offspring += param
-                                    found = True
-                        elif len(offspring) > 1:
-                            print "#\t-> Removing parameter to configuration"
-                            #remove 1 parameter
-                            idx = random.randint(0,len(offspring)-1)
-                            offspring -= offspring.parameters[offspring.parameter_keys()[idx]]
+                            if random.randint(0, 1) and len(offspring) < len(self.__config):
+                                print "#\t-> Adding paraleter to configuration"
+                                # we add a new parameter to this configuration
+                                found = False
+                                while not found:
+                                    idx = random.randint(0,len(self.__config)-1)
+                                    param = self.__config.parameters[self.__config.parameter_keys()[idx]]
+                                    if param.name not in offspring.parameter_keys():
+                                        offspring += param
+                                        found = True
+                            elif len(offspring) > 1:
+                                print "#\t-> Removing parameter to configuration"
+                                #remove 1 parameter
+                                idx = random.randint(0,len(offspring)-1)
+                                offspring -= offspring.parameters[offspring.parameter_keys()[idx]]
                 
-                # Kicking out the elements with the lowest fitness from the population
-                # by replacing with the new offspings
-                self.__pop[self.__pop.index(tournament[-1])] = offspring1
-                self.__pop[self.__pop.index(tournament[-2])] = offspring2
+                    # Kicking out the elements with the lowest fitness from the population
+                    # by replacing with the new offspings
+                    self.__pop[self.__pop.index(tournament[-1])] = offspring1
+                    self.__pop[self.__pop.index(tournament[-2])] = offspring2
                 
-                print "#    End tournament:\n#\tLocal maximal fitness = {0:.4f}, Global maximal = {1:.4f}".\
-                    format(tournament_max, max_fitness)
-                generation_number += 1
-                
-                print  '#{0}#'.format('~' * 78)
+                    print "#    End tournament:\n#\tLocal maximal fitness = {0:.4f}, Global maximal = {1:.4f}".\
+                        format(tournament_max, max_fitness)
+                    generation_number += 1
+                    
+                    print  '#{0}#'.format('~' * 78)
             
             repeatitions+=1
             
         raise StopIteration
+
+# Hill climbing
+class HillClimbingIterator:
+    """ Local search over the configurations: starting from the default one
+    (or from a random one when a parameter has no default) all the neighbours
+    of the current configuration, those one step away according to next/prev
+    of a single parameter, are yielded at once (so that a parallel runner
+    evaluates them concurrently), then the search moves to the one with the
+    highest speedup. When no neighbour improves the current configuration the
+    search restarts from a random configuration, up to 'restarts' times. At
+    most 'budget' configurations are evaluated, each of them only once. """
+    
+    def __init__(self, config, constraints, restarts=10, budget=1000, seed=-1):
+        self.__config = config
+        self.__constraints = constraints
+        self.__restarts = restarts
+        self.__budget = budget
+        self.__seed = seed
+    
+    @property
+    def configuration(self):
+        return self.__config
+        
+    def __iter__(self):
+        return self.next() 
+    
+    def discardLastConf(self):
+        pass
+        
+    def reset(self):
+        self.__schema = Schema(self.__config)
+        # speedup of each point evaluated so far
+        self.__known = {}
+        self.__best = None
+        if self.__seed != -1:
+            random.seed(self.__seed)
+    
+    def __apply(self, point):
+        for (name, idx) in zip(self.__schema.names, point.indices):
+            param = self.__config.parameters[name]
+            if idx is None:
+                param.resetToDefault()
+            else:
+                param.setValueIdx(idx)
+    
+    def __feasible(self, point):
+        self.__apply(point)
+        return self.__config.check(self.__constraints)
+    
+    def __start(self, restart):
+        params = [ self.__config.parameters[name] for name in self.__schema.names ]
+        if restart == 0 and all([ p.default is not None or not len(p) for p in params ]):
+            for param in params:
+                # the index of the default value when it is in the list
+                param.setValue(param.default)
+            point = self.__schema.point(self.__config)
+            if self.__feasible(point):
+                return point
+        # random restart, the points already evaluated are avoided if possible 
+        point = None
+        for attempt in range(100):
+            for param in params:
+                if len(param):
+                    param.rand()
+            if self.__config.check(self.__constraints):
+                point = self.__schema.point(self.__config)
+                if point not in self.__known:
+                    break
+        return point
+    
+    def neighbours(self, point):
+        """ The feasible points one step away from 'point' """
+        ret = []
+        for name in self.__schema.names:
+            param = self.__config.parameters[name]
+            if not len(param):
+                continue
+            for step in (param.next, param.prev):
+                self.__apply(point)
+                try:
+                    step()
+                except (OutOfBoundsExcection, ValueError):
+                    # the value is at one end of the list
+                    continue
+                if self.__config.check(self.__constraints):
+                    ret.append( self.__schema.point(self.__config) )
+        return ret
+    
+    def __evaluate(self, points, step):
+        # yields the configurations of the 'points' not evaluated yet, then 
+        # waits for their speedup
+        pending = []
+        for point in points:
+            if point in self.__known or point in [ p for (p, _) in pending ]:
+                continue
+            if len(self.__known) + len(pending) >= self.__budget:
+                break
+            print  '#{0}#'.format('-' * 78)
+            print ("#    HillClimbing: step {0}, configuration {1}/{2} (evaluated so far: {3})".\
+                    format(step, len(pending)+1, len(points), len(self.__known) + len(pending)))
+            print  '#{0}#'.format('-' * 78)
+            self.__apply(point)
+            conf = deepcopy(self.__config)
+            pending.append( (point, conf) )
+            yield conf
+        for (point, conf) in pending:
+            self.__known[point] = conf.getSpeedup()
+            if self.__best is None or self.__known[point] > self.__known[self.__best]:
+                self.__best = point
+    
+    def next(self):
+        self.reset()
+        for restart in range(self.__restarts + 1):
+            current = self.__start(restart)
+            if current is None or len(self.__known) >= self.__budget:
+                break
+            print '#{0}#'.format('*' * 78)
+            print "#    HillClimbing: {0} from {1}".format("start" if restart == 0 else "restart", current)
+            step = 0
+            for conf in self.__evaluate([ current ], step):
+                yield conf
+            while current in self.__known and len(self.__known) < self.__budget:
+                step += 1
+                neighbours = self.neighbours(current)
+                for conf in self.__evaluate(neighbours, step):
+                    yield conf
+                candidates = [ p for p in neighbours if p in self.__known ]
+                best = max(candidates, key=lambda p: self.__known[p]) if candidates else None
+                if best is None or self.__known[best] <= self.__known[current]:
+                    print "#    HillClimbing: local maximum reached, speedup = {0:.5f}".format(self.__known[current])
+                    break
+                current = best
+                print "#    HillClimbing: moving to {0}, speedup = {1:.5f}".format(current, self.__known[current])
+            if len(self.__known) >= self.__budget:
+                print "#    HillClimbing: evaluation budget ({0}) exhausted".format(self.__budget)
+                break
+        if self.__best is not None:
+            print '#{0}#'.format('*' * 78)
+            print "#    HillClimbing: best configuration {0}, speedup = {1:.5f} ({2} evaluated)".\
+                    format(self.__best, self.__known[self.__best], len(self.__known))
+        for param in self.__config.parameters.values():
+            param.reset()
+
+# Bayesian optimization
+class BayesianSearchIterator:
+    """ Model based search (Tree-structured Parzen Estimator): the evaluated 
+    configurations are split into the 'gamma' fraction with the highest 
+    speedup and the others, the values of each parameter are modelled by a 
+    density for each group and the configuration maximizing the ratio of the
+    densities of the good and of the bad group (which is proportional to the
+    expected improvement) among 'candidates' ones sampled from the good group
+    is evaluated next. Parameters whose values are all numbers are ordinal 
+    (Gaussian kernels over the positions of the values), the others are 
+    categorical. The first 'startup' configurations (the default one, then
+    random ones) are not proposed by the model.
+    The configurations are proposed in batches of 'batch', yielded at once so
+    that parallel runners evaluate them concurrently: the model is updated
+    once per batch, whose configurations are the best distinct candidates. 
+    At most 'iterations' configurations are evaluated. """
+    
+    def __init__(self, config, constraints, iterations=50, batch=1, startup=10, candidates=256, gamma=0.25,
+                 seed=-1):
+        self.__config = config
+        self.__constraints = constraints
+        self.__iterations = iterations
+        self.__batch = max(1, batch)
+        self.__startup = max(1, startup)
+        self.__candidates = candidates
+        self.__gamma = gamma
+        self.__seed = seed
+    
+    @property
+    def configuration(self):
+        return self.__config
+        
+    def __iter__(self):
+        return self.next() 
+    
+    def discardLastConf(self):
+        pass
+        
+    def reset(self):
+        self.__schema = Schema(self.__config)
+        # the parameters searched (the others keep their default value) and 
+        # whether they are ordinal
+        self.__params = [ self.__config.parameters[name] for name in self.__schema.names 
+                            if len(self.__config.parameters[name]) ]
+        self.__ordinal = [ all([ not isinstance(convert(v), basestring) for v in p ]) for p in self.__params ]
+        # (indices, speedup) of the configurations evaluated so far
+        self.__observed = []
+        if self.__seed != -1:
+            random.seed(self.__seed)
+    
+    def __apply(self, indices):
+        for (param, idx) in zip(self.__params, indices):
+            param.setValueIdx(idx)
+        return self.__config.check(self.__constraints)
+    
+    def __density(self, dim, samples):
+        # probability of each value of the parameter 'dim' given the indices 
+        # 'samples', with a uniform prior worth a single sample
+        n = len(self.__params[dim])
+        weights = [ 1.0 / n ] * n
+        if self.__ordinal[dim]:
+            width = max(0.5, (n - 1) / (2.0 * math.sqrt(len(samples) + 1)))
+            for s in samples:
+                kernel = [ math.exp(-0.5 * ((i - s) / width) ** 2) for i in range(n) ]
+                total = sum(kernel)
+                weights = [ w + k / total for (w, k) in zip(weights, kernel) ]
+        else:
+            for s in samples:
+                weights[s] += 1.0
+        total = sum(weights)
+        return [ w / total for w in weights ]
+    
+    def __sample(self, weights):
+        r = random.random()
+        for (i, w) in enumerate(weights):
+            r -= w
+            if r < 0:
+                return i
+        return len(weights) - 1
+    
+    def __random(self, excluded):
+        for attempt in range(1000):
+            indices = tuple([ random.randint(0, len(p)-1) for p in self.__params ])
+            if indices not in excluded and self.__apply(indices):
+                return indices
+        return None
+    
+    def __default(self):
+        # indices of the default configuration, None when some default is 
+        # not among the values of its parameter
+        indices = []
+        for param in self.__params:
+            if param.default not in list(param):
+                return None
+            indices.append( list(param).index(param.default) )
+        indices = tuple(indices)
+        return indices if self.__apply(indices) else None
+    
+    def __propose(self, pending):
+        """ The indices of the next configuration to evaluate, given the ones 
+        being evaluated ('pending') """
+        excluded = set([ x for (x, _) in self.__observed ]) | set(pending)
+        if len(self.__observed) + len(pending) < self.__startup:
+            default = self.__default() if not self.__observed and not pending else None
+            return default if default is not None else self.__random(excluded)
+        
+        ranked = sorted(self.__observed, key=lambda (x, speedup): speedup, reverse=True)
+        n_good = max(1, int(math.ceil(self.__gamma * len(ranked))))
+        good = [ x for (x, _) in ranked[:n_good] ]
+        bad = [ x for (x, _) in ranked[n_good:] ]
+        dims = range(len(self.__params))
+        l = [ self.__density(d, [ x[d] for x in good ]) for d in dims ]
+        g = [ self.__density(d, [ x[d] for x in bad ]) for d in dims ]
+        
+        candidates = set()
+        for i in range(self.__candidates):
+            indices = tuple([ self.__sample(l[d]) for d in dims ])
+            if indices not in excluded:
+                candidates.add( indices )
+        candidates = [ x for x in sorted(candidates) if self.__apply(x) ]
+        if not candidates:
+            return self.__random(excluded)
+        if numpy is not None:
+            ratio = [ numpy.log(numpy.array(l[d])) - numpy.log(numpy.array(g[d])) for d in dims ]
+            points = numpy.array(candidates)
+            scores = sum([ ratio[d][points[:, d]] for d in dims ])
+            return candidates[ int(numpy.argmax(scores)) ]
+        score = lambda x: sum([ math.log(l[d][x[d]]) - math.log(g[d][x[d]]) for d in dims ])
+        return max(candidates, key=score)
+    
+    def next(self):
+        self.reset()
+        best = None
+        while len(self.__observed) < self.__iterations:
+            pending = []
+            while len(pending) < min(self.__batch, self.__iterations - len(self.__observed)):
+                indices = self.__propose(pending)
+                if indices is None:
+                    break
+                pending.append( indices )
+            if not pending:
+                print "#    BayesianSearch: no configuration left to evaluate"
+                break
+            
+            confs = []
+            for indices in pending:
+                print  '#{0}#'.format('-' * 78)
+                print ("#    BayesianSearch: configuration {0}/{1}".\
+                        format(len(self.__observed) + len(confs) + 1, self.__iterations))
+                print  '#{0}#'.format('-' * 78)
+                self.__apply(indices)
+                conf = deepcopy(self.__config)
+                confs.append( conf )
+                yield conf
+            for (indices, conf) in zip(pending, confs):
+                self.__observed.append( (indices, conf.getSpeedup()) )
+                if best is None or self.__observed[-1][1] > best[1]:
+                    best = (self.__schema.point(conf), self.__observed[-1][1])
+            print "#    BayesianSearch: best configuration {0}, speedup = {1:.5f}".format(*best)
+        for param in self.__config.parameters.values():
+            param.reset()
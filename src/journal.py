@@ -0,0 +1,142 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, json, hashlib, threading
+import results
+
+def conf_key(conf):
+    """ Identifies a configuration by the values of its parameters """
+    values = sorted( [ (name, p.currValue()) for (name, p) in conf.parameters.items() ] )
+    return hashlib.sha1( json.dumps(values) ).hexdigest()[:16]
+
+def file_sizes(files):
+    # sizes are measured by the results store, which knows about the results
+    # not yet written onto the files
+    sizes = {}
+    for file_name in files:
+        if file_name:
+            sizes[file_name] = results.get().size(file_name)
+    return sizes
+
+class Journal:
+    """ Log of the progress of a benchmark, one JSON record per line. It stores
+    the seed of the random number generator, every completed run and every
+    completed configuration (with its speedup and aggregated values) together
+    with the size of the files written so far.
+
+    When a benchmark is resumed the files are truncated to the last size
+    recorded (dropping half written lines, or the records written afterwards 
+    when the results are stored in a database) and, because the iterators are
+    driven by the same seed and receive the same fitness values, the search
+    replays exactly the same sequence of configurations: completed ones are
+    not executed again and the runs already completed are reused.
+    A configuration is identified by the values of its parameters and by how
+    many times the same values were already evaluated. """
+
+    def __init__(self, file_name, resume=False):
+        self.__lock = threading.Lock()
+        self.__occurrences = {}
+        # files whose size has already been recorded
+        self.__known = set()
+        self.__done = {}
+        self.__runs = {}
+        self.seed = None
+
+        valid = 0
+        if resume and os.path.exists(file_name):
+            sizes = {}
+            f = open(file_name)
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    # half written record, everything after it is discarded
+                    break
+                valid += len(line)
+                ident = tuple(rec.get('id', ()))
+                if rec['type'] == 'start':
+                    self.seed = rec['seed']
+                elif rec['type'] == 'run':
+                    self.__runs.setdefault(ident, []).append(rec)
+                elif rec['type'] == 'done':
+                    self.__done[ident] = rec
+                sizes.update( rec.get('files', {}) )
+            f.close()
+            self.__known = set(sizes.keys())
+            for (file_name_, size) in sizes.items():
+                results.get().truncate(file_name_, size)
+            print "* Resuming from journal '{0}': {1} configurations completed".format(file_name, len(self.__done))
+
+        self.__file = open(file_name, 'a' if valid else 'w')
+        self.__file.truncate(valid)
+
+    def __write(self, rec):
+        self.__known.update( rec.get('files', {}).keys() )
+        self.__file.write( json.dumps(rec) + '\n' )
+        self.__file.flush()
+
+    def start(self, seed):
+        self.seed = seed
+        self.__lock.acquire()
+        self.__write( { 'type': 'start', 'seed': seed } )
+        self.__lock.release()
+
+    def begin(self, conf, files):
+        """ Registers the start of the evaluation of 'conf' and returns its
+        identifier. 'files' are the files the evaluation writes onto. """
+        self.__lock.acquire()
+        try:
+            key = conf_key(conf)
+            occurrence = self.__occurrences.get(key, 0)
+            self.__occurrences[key] = occurrence + 1
+            ident = (key, occurrence)
+            if ident not in self.__done:
+                # the size of the files is recorded before they are written 
+                # for the first time, later on it's recorded by the completed 
+                # runs and configurations
+                files = [ f for f in files if f not in self.__known ]
+                self.__write( { 'type': 'begin', 'id': ident, 'files': file_sizes(files) } )
+            return ident
+        finally:
+            self.__lock.release()
+
+    def completed(self, ident):
+        """ Returns the record of the configuration 'ident' if it was already
+        completed (with the 'speedup' and 'res' entries), None otherwise """
+        return self.__done.get(ident)
+
+    def completedRuns(self, ident):
+        """ Returns, for each run of 'ident' already completed, the list of the
+        (extracted data, status, code, metrics) of its commands """
+        runs = sorted( self.__runs.get(ident, []), key=lambda rec: rec['run'] )
+        return [ rec['cmds'] for rec in runs ]
+
+    def run(self, ident, run, cmds, files):
+        """ Records the completion of the 'run'-th run of 'ident', 'cmds' lists
+        the (extracted data, status, code, metrics) of each command """
+        self.__lock.acquire()
+        self.__write( { 'type': 'run', 'id': ident, 'run': run, 'cmds': cmds,
+                        'files': file_sizes(files) } )
+        self.__lock.release()
+
+    def finish(self, ident, speedup, res, files):
+        self.__lock.acquire()
+        self.__write( { 'type': 'done', 'id': ident, 'speedup': speedup, 'res': res,
+                        'files': file_sizes(files) } )
+        self.__lock.release()
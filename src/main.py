@@ -21,9 +21,10 @@ import optparse, sys, os, re
 from parameter import Parameter
 from configuration import Constrain
 from config_parse import ConfigSection, ConfigFileParser
-from iterator import ConfigIterator, CompoundConfigIterator, RandConfigIterator, SingleConfIterator, GeneticSearchIterator
+from iterator import ConfigIterator, CompoundConfigIterator, RandConfigIterator, SingleConfIterator, GeneticSearchIterator, \
+                     HillClimbingIterator, BayesianSearchIterator
 from copy import deepcopy
-import runner
+import runner, extractor, cache, journal, results, initialize, halving, pycall
 from util import *
 import random, math, shutil
 
@@ -51,11 +52,57 @@ def main(argv=None):
                             "section of the configuration file, default= %default"),
                       default="False")
     
+    parser.add_option("--bayesian", action="store_true", dest="bayesian",
+                      help=("Enable Bayesian optimization (TPE) of the parameters in the 'Optimize' "
+                            "section of the configuration file, default %default"),
+                      default="False")
+    
+    parser.add_option("--successive-halving", action="store_true", dest="halving",
+                      help=("Enable the successive halving search on the parameters in the 'Optimize' "
+                            "section of the configuration file: many configurations are evaluated with "
+                            "few runs (or a cheap value of a fidelity parameter), only the best ones "
+                            "with the full budget, default %default"),
+                      default="False")
+    
     parser.add_option("--genetic", action="store_true", dest="genetic", 
                       help=("Enable genetic search on the parameters on the 'Optimize'"
                             "section of the configuration file, default %default"),
                       default="False")
     
+    parser.add_option("-j", "--jobs", type="int", dest="jobs", 
+                      help=("Number of configurations executed in parallel on the local machine, "
+                            "each one pinned to a disjoint set of cores (and of independent "
+                            "initialize commands), default: %default"),
+                      default="1")
+    
+    parser.add_option("--interleave", type="choice", dest="interleave", choices=[runner.ROUND_ROBIN, runner.RANDOM],
+                      help=("Execute the runs of the configurations (and of the default one) by rounds, "
+                            "a run of each configuration per round, in the iteration order ('round-robin') "
+                            "or in a random order ('random'). The speedup is computed from the runs of "
+                            "the same round. Only for the local (not parallel) runner"))
+    
+    parser.add_option("--cache-dir", type="string", dest="cache_dir", 
+                      help=("Directory of the result cache, configurations whose results are "
+                            "found in the cache are not executed again"))
+    
+    parser.add_option("--invalidate-cache", action="store_true", dest="invalidate_cache", 
+                      help=("Ignore the results stored in the cache, configurations are executed "
+                            "again and their cached results replaced, default: %default"),
+                      default=False)
+    
+    parser.add_option("--journal", type="string", dest="journal", 
+                      help=("File where the progress of the benchmark is logged, "
+                            "default: <config file>.journal"))
+    
+    parser.add_option("--resume", action="store_true", dest="resume", 
+                      help=("Resume an interrupted benchmark from its journal, configurations "
+                            "already completed are not executed again, default: %default"),
+                      default=False)
+    
+    parser.add_option("--results-db", type="string", dest="results_db", 
+                      help=("Store the results (aggregated rows and samples) in a SQLite database "
+                            "instead of text files, they can be exported as text with results.py"))
+    
     (options, args) = parser.parse_args()
     
     if not options.config_file:
@@ -64,6 +111,11 @@ def main(argv=None):
     if not os.path.exists(options.config_file):
         parser.error("Error: Configuration file '{0}' doesn't exist.".format(options.config_file))
     
+    if options.interleave and (options.genetic is True or options.hill_climbing is True or 
+                               options.bayesian is True or options.halving is True or options.jobs > 1):
+        parser.error("Error: --interleave cannot be used with --genetic, --hill-climbing, --bayesian, "
+                     "--successive-halving or --jobs")
+    
     config = ConfigFileParser(options.config_file)
     
     main = ConfigSection(config, 'Benchmark')
@@ -71,14 +123,53 @@ def main(argv=None):
     benchmark = main.parameters['benchmark']
 
     default =  main.parameters['default'] if 'default' in main.parameters.keys() else None
+    if options.hill_climbing is True and not default:
+        parser.error("Error: --hill-climbing moves towards the highest speedup, "
+                     "the 'default' benchmark is needed")
+    if options.bayesian is True and not default:
+        parser.error("Error: --bayesian models the speedup of the configurations, "
+                     "the 'default' benchmark is needed")
     
     main -= initialization
     main -= benchmark
+    # files read and written by the initialize commands (see initialize.Initializer)
+    init_files = []
+    for name in ('init_inputs', 'init_outputs'):
+        init_files.append( list(main.parameters[name]) if name in main.parameters.keys() else [] )
+        if name in main.parameters.keys():
+            main -= main.parameters[name]
     
     if 'default' in main.parameters.keys():
         main -= default
     if 'use_sge' not in main.parameters.keys():
 	main += Parameter('use_sge', ['False'], 'False')
+    use_sge = main.use_sge.currValue() == "True" or main.use_sge.currValue() == 1
+    if use_sge and options.extract != True and \
+            [ cmd for cmd in list(benchmark) + list(default or []) if pycall.is_call(cmd.strip()) ]:
+        parser.error("Error: the Python callables (py:module:function) are executed by local workers, "
+                     "they cannot be submitted to SGE")
+    
+    halving_conf = { 'configurations': 81, 'eta': 3, 'fidelity': 'num_of_runs', 'min_runs': 1, 
+                     'hyperband': False }
+    fidelity = None
+    if options.halving is True:
+        if not default:
+            parser.error("Error: --successive-halving ranks the configurations by their speedup, "
+                         "the 'default' benchmark is needed")
+        if config.sections.has_key('SuccessiveHalving'):
+            section = ConfigSection(config, 'SuccessiveHalving')
+            for name in halving_conf.keys():
+                if name in section.parameters.keys():
+                    halving_conf[name] = section.parameters[name].currValue()
+        name = halving_conf['fidelity']
+        if name not in main.parameters.keys():
+            parser.error("Error: the fidelity parameter '{0}' is not in the 'Benchmark' section".format(name))
+        if name == 'num_of_runs':
+            rungs = halving.budgets(max(list(main.num_of_runs) or [ main.num_of_runs.currValue() ]), 
+                                    halving_conf['eta'], halving_conf['min_runs'])
+        else:
+            rungs = list(main.parameters[name]) or [ main.parameters[name].currValue() ]
+        fidelity = Parameter(name, rungs, rungs[-1])
 
     print ("Parameters in the main benchmark: ")
     print (main)
@@ -87,6 +178,12 @@ def main(argv=None):
     print ("Optimizing parameters:")
     print (optimize)
     
+    # the parallel runs are the load the noise guard would wait for
+    noise_params = [ name for name in main.parameters.keys() + optimize.parameters.keys() 
+                        if name.startswith('noise_') ]
+    if noise_params and options.jobs > 1 and options.extract != True:
+        parser.error("Error: the noise guard ({0}) cannot be used with --jobs".format(", ".join(noise_params)))
+    
     # reads the invariants
     constrains = []
     if config.sections.has_key('Constrains'):
@@ -95,51 +192,155 @@ def main(argv=None):
     if len(initialization) > 0:
         str = "Initializing the environment"
         print "#{0} {1:^} {0}#".format('~' * int(math.ceil((80 - len(str))/2)-2), str)
-        r = runner.LocalRunner(ConfigIterator(main, constrains))
-        r.run(initialization, init=True)
+        r = initialize.Initializer(ConfigIterator(main, constrains), initialization, *init_files)
+        r.run(options.jobs)
         print "@{0}@".format(78 * "-")
     
-    extract = ConfigSection(config, 'Extract')
+    if fidelity is not None:
+        # the search sets the fidelity parameter, which is no longer iterated by the 
+        # main benchmark (the environment is initialized for all its values)
+        halving.pin(main, fidelity.name, fidelity.default)
+    
+    # the extraction patterns are compiled once for the whole benchmark
+    extract_section = ConfigSection(config, 'Extract')
+    extract = extractor.fromSection( extract_section )
+    
+    res_cache = None
+    if options.cache_dir:
+        # results depend on what is extracted from the output as well
+        res_cache = cache.ResultCache(options.cache_dir, options.invalidate_cache, 
+                        repr([ (p.name, p.values) for p in extract_section.parameters.values() ]))
     elaborate = ConfigSection(config, 'Elaborate')
     
+    if options.results_db:
+        results.use( results.SQLiteStore(options.results_db) )
+    
+    progress = None
+    if options.extract != True:
+        progress = journal.Journal(options.journal or options.config_file + '.journal', options.resume)
+        # the search is replayed with the seed of the interrupted benchmark 
+        seed = progress.seed
+        if seed is None:
+            seed = options.seed if options.seed != -1 else random.randint(0, 2**31-1)
+            progress.start(seed)
+        random.seed(seed)
+    
     str = "Starting the benchmark"
     print "#{0} {1:^} {0}#".format('~' * int(math.ceil((80 - len(str))/2)-2), str)
     
-    for conf in ConfigIterator(main, constrains):
+    main_iter = ConfigIterator(main, constrains)
+    if options.jobs > 1 and not default and options.rand == 0 and options.genetic is not True and \
+            options.hill_climbing is not True and options.bayesian is not True and \
+            options.extract != True and (main.use_sge.currValue() == "False" or main.use_sge.currValue() == 0):
+        # there is no default configuration to evaluate for each point of the main 
+        # benchmark, therefore the whole sweep is handed to the parallel runner at once
+        r = runner.LocalRunner(CompoundConfigIterator([ConfigIterator(main, constrains), 
+                ConfigIterator(optimize, constrains)], constrains), extract, elaborate, options.jobs, res_cache,
+                progress)
+        r.run(benchmark)
+        main_iter = []
+        
+    # the runs are interleaved by the local runner only
+    interleave = None
+    if options.extract != True and (main.use_sge.currValue() == "False" or main.use_sge.currValue() == 0):
+        interleave = options.interleave
+    
+    # configurations submitted as a single SGE array job
+    array_jobs = False
+    if use_sge:
+        SGE = ConfigSection(config, 'SGE')
+        array_jobs = 'array_jobs' in SGE.parameters.keys() and \
+                     (SGE.array_jobs.currValue() == "True" or SGE.array_jobs.currValue() == 1)
+    
+    def new_runner(conf_iter, wait=False, interleave=None, array=False):
+        # runner of the configurations of 'conf_iter', the default one is waited for
+        if options.extract == True:
+            return runner.ExtractRunner(conf_iter, elaborate, res_cache)
+        if use_sge:
+            return runner.SGERunner(conf_iter, ConfigSection(config, 'SGE'), wait, extract, elaborate,
+                                    res_cache, progress, array)
+        return runner.LocalRunner(conf_iter, extract, elaborate, 1 if wait else options.jobs, res_cache,
+                                  progress, interleave)
+    
+    for conf in main_iter:
+        if fidelity is not None:
+            # the default configuration is evaluated with the budget of each rung
+            def_vals = {}
+            def evaluate(confs, budget):
+                key = budget.currValue()
+                parent = deepcopy(conf)
+                halving.pin(parent, budget.name, key)
+                if key not in def_vals:
+                    print "-> Running  default ({0}={1}) <-".format(budget.name, key)
+                    opt_cpy = deepcopy(optimize)
+                    opt_cpy.setDefault()
+                    def_vals[key] = new_runner(SingleConfIterator(parent+opt_cpy), True).run(default)
+                # the configurations of a rung do not depend on each other
+                new_runner(confs, array=array_jobs).run(benchmark, parent, False, def_vals[key])
+            
+            hyperband = halving_conf['hyperband']
+            halving.SuccessiveHalving(optimize, constrains, fidelity, halving_conf['configurations'], 
+                    halving_conf['eta'], hyperband is True or hyperband in ('True', 1), 
+                    seed=options.seed).run(evaluate)
+            continue
+        
         def_vals = None
-        if default:
+        reference = None
+        if default and interleave:
+            # the default configuration is evaluated together with the others
+            opt_cpy = deepcopy(optimize)
+            opt_cpy.setDefault()
+            reference = (default, conf+opt_cpy)
+        elif default:
             print "-> Running  default <-"
             opt_cpy = deepcopy(optimize)
             opt_cpy.setDefault()
-            if options.extract == True:
-                r = runner.ExtractRunner(SingleConfIterator(conf+opt_cpy), elaborate)
-            elif main.use_sge.currValue() == "False" or main.use_sge.currValue() == 0:   
-                r = runner.LocalRunner(SingleConfIterator(conf+opt_cpy), extract.experiment_data, elaborate)
-            elif main.use_sge.currValue() == "True" or main.use_sge.currValue() == 1:
-            	SGE = ConfigSection(config, 'SGE')
-            	r = runner.SGERunner(SingleConfIterator(conf+opt_cpy), SGE, False, extract.experiment_data, elaborate)
-            def_vals = r.run(default)
+            def_vals = new_runner(SingleConfIterator(conf+opt_cpy), True).run(default)
      
         opt_param_iter = None
         if options.rand > 0:
             opt_param_iter = RandConfigIterator(optimize, constrains, options.rand, options.seed)
         elif options.genetic is True:
             genetic_conf = ConfigSection(config, 'GeneticSearch')
+            fitness_file = None
+            if 'fitness_file' in genetic_conf.parameters.keys():
+                fitness_file = sobstitute(genetic_conf.fitness_file.currValue(), conf)
             opt_param_iter = GeneticSearchIterator(optimize, constrains, 
-                sobstitute(genetic_conf.log_file.currValue(), conf), genetic_conf, seed=options.seed)
+                sobstitute(genetic_conf.log_file.currValue(), conf), genetic_conf, seed=options.seed,
+                fitness_file=fitness_file)
+        elif options.hill_climbing is True:
+            (restarts, budget) = (10, 1000)
+            if config.sections.has_key('HillClimbing'):
+                hill_conf = ConfigSection(config, 'HillClimbing')
+                if 'restarts' in hill_conf.parameters.keys():
+                    restarts = hill_conf.restarts.currValue()
+                if 'budget' in hill_conf.parameters.keys():
+                    budget = hill_conf.budget.currValue()
+            opt_param_iter = HillClimbingIterator(optimize, constrains, restarts, budget, seed=options.seed)
+        elif options.bayesian is True:
+            # a batch of configurations keeps the parallel workers busy
+            bayes = { 'iterations': 50, 'batch': options.jobs, 'startup': 10, 'candidates': 256, 'gamma': 0.25 }
+            if config.sections.has_key('BayesianSearch'):
+                bayes_conf = ConfigSection(config, 'BayesianSearch')
+                for name in bayes.keys():
+                    if name in bayes_conf.parameters.keys():
+                        bayes[name] = bayes_conf.parameters[name].currValue()
+            opt_param_iter = BayesianSearchIterator(optimize, constrains, seed=options.seed, **bayes)
         else:
             opt_param_iter = ConfigIterator(optimize, constrains)
             
-        if options.extract == True:
-            r = runner.ExtractRunner(opt_param_iter, elaborate)
-        elif main.use_sge.currValue() == "False" or main.use_sge.currValue() == 0:    
-            r = runner.LocalRunner(opt_param_iter, extract.experiment_data, elaborate)
-        elif main.use_sge.currValue() == "True" or main.use_sge.currValue() == 1:
-            SGE = ConfigSection(config, 'SGE')
-            r = runner.SGERunner(opt_param_iter, SGE, True, extract.experiment_data, elaborate)
+        # the genetic search (and the hill climbing) needs the results to produce 
+        # the next configurations
+        array = array_jobs and options.genetic is not True and options.hill_climbing is not True and \
+                options.bayesian is not True
+        r = new_runner(opt_param_iter, interleave=interleave, array=array)
         
-        r.run(benchmark, conf, False, def_vals)
+        if reference is not None:
+            r.run(benchmark, conf, False, None, reference)
+        else:
+            r.run(benchmark, conf, False, def_vals)
     print "@{0}@".format(78 * "-")
+    results.get().close()
     
     #~ print '* Ordering results *'
     #~ for conf in ConfigIterator(main, constrains):
@@ -0,0 +1,111 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, errno
+
+# Resources used by each run, they can be referred in the out_file_format as
+# '@name' (e.g. AVG(@max_rss)):
+#   wall            elapsed time (seconds)
+#   utime, stime    user and system CPU time (seconds)
+#   max_rss         peak resident set size (KB)
+#   minflt, majflt  minor and major page faults
+#   nvcsw, nivcsw   voluntary and involuntary context switches
+#   inblock, oublock  blocks read and written by the file system
+# and, when the run is executed in a cgroup:
+#   cg_mem_peak     peak memory usage of the cgroup (KB)
+#   cg_usage, cg_user, cg_system  CPU time of the cgroup (seconds)
+# and, when the noise guard is enabled, the state of the host before the run
+# (noise_load, noise_idle, noise_pressure, noise_freq, noise_wait, noisy and
+# rejected, see the noise module)
+PREFIX = '@'
+
+RUSAGE_FIELDS = [ ('utime', 'ru_utime'), ('stime', 'ru_stime'), ('max_rss', 'ru_maxrss'),
+                  ('minflt', 'ru_minflt'), ('majflt', 'ru_majflt'), ('nvcsw', 'ru_nvcsw'),
+                  ('nivcsw', 'ru_nivcsw'), ('inblock', 'ru_inblock'), ('oublock', 'ru_oublock') ]
+
+def from_rusage(rusage, wall):
+    """ Returns the metrics of a run from the resource usage returned by wait4
+    and its elapsed time """
+    metrics = { 'wall': wall }
+    for (name, field) in RUSAGE_FIELDS:
+        metrics[name] = getattr(rusage, field)
+    return metrics
+
+class TransientCgroup:
+    """ A cgroup (v2) created, below the 'parent' cgroup, for the execution of a
+    single run. The parent must be delegated to the user running the benchmark
+    (e.g. a systemd user slice or a directory created by root under
+    /sys/fs/cgroup) with the memory and cpu controllers enabled for its
+    children. """
+
+    def __init__(self, parent):
+        self.path = os.path.join(parent, 'benchrunner-{0}-{1}'.format(os.getpid(), id(self)))
+        os.mkdir(self.path)
+        if not os.access(os.path.join(self.path, 'cgroup.procs'), os.W_OK):
+            self.remove()
+            raise OSError(errno.EACCES, 'cgroup.procs is not writable')
+
+    def join(self):
+        """ Moves the calling process in the cgroup (called by the child before
+        executing the command), returns False when it cannot be moved """
+        try:
+            f = open(os.path.join(self.path, 'cgroup.procs'), 'w')
+            try:
+                f.write('0')
+            finally:
+                f.close()
+        except (IOError, OSError):
+            return False
+        return True
+
+    def __read(self, name):
+        file_name = os.path.join(self.path, name)
+        if not os.path.exists(file_name):
+            return None
+        return open(file_name).read()
+
+    def metrics(self):
+        """ The statistics of the cgroup, none when no process ran in it (the
+        command could not join it) """
+        metrics = {}
+        peak = self.__read('memory.peak')
+        if peak:
+            metrics['cg_mem_peak'] = int(peak) / 1024
+        for line in (self.__read('cpu.stat') or '').splitlines():
+            (key, val) = line.split()
+            if key in ('usage_usec', 'user_usec', 'system_usec'):
+                metrics[ 'cg_' + key[:-5] ] = int(val) / 1e6
+        if metrics.get('cg_usage') == 0:
+            return {}
+        return metrics
+
+    def remove(self):
+        try:
+            os.rmdir(self.path)
+        except OSError:
+            # processes of the run still alive
+            pass
+
+def transient_cgroup(parent):
+    """ Creates the cgroup for a run, returns None (and the run is executed
+    without it) when it cannot be created """
+    try:
+        return TransientCgroup(parent)
+    except OSError as e:
+        print "* Cannot create a cgroup in '{0}': {1}".format(parent, e.strerror)
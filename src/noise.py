@@ -0,0 +1,138 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, glob, time
+
+# State of the host sampled before each run by the noise guard, recorded with
+# the metrics of the run (see the metrics module):
+#   noise_load      load average of the last minute
+#   noise_idle      idle CPU time (%) over the sampling interval
+#   noise_pressure  highest 'some avg10' pressure (%) of cpu, io and memory
+#   noise_freq      mean current / maximum CPU frequency
+#   noise_wait      time (seconds) waited for the host to become quiet
+#   noisy           1 when the thresholds were not met (the run is flagged)
+PRESSURE = [ '/proc/pressure/cpu', '/proc/pressure/io', '/proc/pressure/memory' ]
+CPUFREQ = '/sys/devices/system/cpu/cpu[0-9]*/cpufreq'
+
+def _read(file_name):
+    try:
+        return open(file_name).read()
+    except IOError:
+        return None
+
+def load_average():
+    text = _read('/proc/loadavg')
+    return float(text.split()[0]) if text else None
+
+def cpu_times():
+    # (idle, total) jiffies of all the CPUs
+    text = _read('/proc/stat')
+    if not text:
+        return None
+    fields = [ int(x) for x in text.splitlines()[0].split()[1:] ]
+    # idle and iowait
+    return (sum(fields[3:5]), sum(fields))
+
+def pressure():
+    values = []
+    for file_name in PRESSURE:
+        for line in (_read(file_name) or '').splitlines():
+            if line.startswith('some'):
+                values.append( float(line.split()[1].split('=')[1]) )
+    return max(values) if values else None
+
+def frequency():
+    ratios = []
+    for path in glob.glob(CPUFREQ):
+        (cur, top) = (_read(os.path.join(path, 'scaling_cur_freq')), _read(os.path.join(path, 'cpuinfo_max_freq')))
+        if cur and top and int(top) > 0:
+            ratios.append( float(cur) / int(top) )
+    return sum(ratios) / len(ratios) if ratios else None
+
+class Guard:
+    """ Checks that the host is quiet before a run: the load average is at most
+    'max_load', the CPUs are idle at least 'min_idle' % of the time, the
+    pressure stall information is at most 'max_pressure' % and the CPU
+    frequency is at least 'min_freq' of the maximum (unset thresholds, or
+    values the host does not provide, are not checked). The run is delayed
+    until the thresholds are met, for at most 'max_wait' seconds, then it is
+    flagged as noisy. With 'reject' the samples of noisy runs are discarded. """
+
+    def __init__(self, max_load=None, min_idle=None, max_pressure=None, min_freq=None, max_wait=60,
+                 reject=False, interval=0.5):
+        self.max_load = max_load
+        self.min_idle = min_idle
+        self.max_pressure = max_pressure
+        self.min_freq = min_freq
+        self.max_wait = max_wait
+        self.reject = reject
+        self.interval = interval
+
+    def sample(self):
+        """ Returns the state of the host, sampled over 'interval' seconds """
+        before = cpu_times()
+        time.sleep(self.interval)
+        after = cpu_times()
+        state = { 'noise_load': load_average(), 'noise_pressure': pressure(), 'noise_freq': frequency(),
+                  'noise_idle': None }
+        if before and after and after[1] > before[1]:
+            state['noise_idle'] = 100.0 * (after[0] - before[0]) / (after[1] - before[1])
+        return dict([ (k, v) for (k, v) in state.items() if v is not None ])
+
+    def quiet(self, state):
+        checks = [ ('noise_load', self.max_load, 1), ('noise_idle', self.min_idle, -1),
+                   ('noise_pressure', self.max_pressure, 1), ('noise_freq', self.min_freq, -1) ]
+        for (name, threshold, sign) in checks:
+            if threshold is not None and name in state and (state[name] - threshold) * sign > 0:
+                return False
+        return True
+
+    def wait(self):
+        """ Waits for the host to become quiet, returns the noise metrics of
+        the run about to start """
+        start = time.time()
+        state = self.sample()
+        announced = False
+        while not self.quiet(state) and time.time() - start < self.max_wait:
+            if not announced:
+                print "* Waiting for the host to become quiet: {0}".format(describe(state))
+                announced = True
+            state = self.sample()
+        state['noise_wait'] = time.time() - start
+        state['noisy'] = 0 if self.quiet(state) else 1
+        if state['noisy']:
+            print "* The host is noisy, the run is flagged: {0}".format(describe(state))
+        return state
+
+def describe(state):
+    return ", ".join([ "{0}={1:.2f}".format(k[6:], v) for (k, v) in sorted(state.items())
+                        if k.startswith('noise_') ])
+
+def from_section(conf):
+    """ Returns the Guard configured by the noise_* parameters of 'conf', None
+    when no threshold is set """
+    params = conf.parameters
+    value = lambda name, default=None: params[name].currValue() if name in params else default
+    thresholds = [ value(name) for name in ('noise_max_load', 'noise_min_idle', 'noise_max_pressure',
+                                            'noise_min_freq') ]
+    if thresholds == [None] * 4:
+        return None
+    reject = value('noise_reject', False)
+    return Guard(*thresholds, max_wait=value('noise_max_wait', 60),
+                 reject=reject is True or reject in ('True', 1))
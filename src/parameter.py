@@ -86,7 +86,9 @@ class Parameter:
         return str(self.currValue())
     
     def __deepcopy__(self, memo):
-        ret = Parameter(self.__name, self.__values[:], self.__default)
+        # the list of values is never modified, therefore it is shared by the 
+        # copies of the parameter
+        ret = Parameter(self.__name, self.__values, self.__default)
         ret.__curr_value_idx = self.__curr_value_idx
         return ret
         
@@ -178,6 +180,23 @@ class Parameter:
             self.__curr_value_idx = None
         self.__update()
     
+    @property
+    def default(self):
+        return self.__default
+    
+    @property
+    def index(self):
+        """ Index of the current value, None when the parameter is assuming
+        its default value.
+        
+        >>> p = Parameter('param_name', range(1,5), 0)
+        >>> p.next(2)
+        3
+        >>> p.index
+        2
+        """
+        return self.__curr_value_idx
+    
     def currValue(self):
         """ Returns the current value for this parameter.
         
@@ -0,0 +1,262 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, sys, imp, json, shlex, select, signal, subprocess, tempfile, threading, atexit, time
+from util import convert
+
+# A benchmark can be a Python callable instead of a shell command:
+#   benchmark: py:module:function arg1 arg2 name=value ... >> {file_name}
+# the arguments (usually parameters, e.g. {mat_size}) are converted to numbers
+# when possible. The callable is loaded once by a worker process which lives
+# as long as BenchRunner, so that a run does not pay the start of the
+# interpreter and the imports. What the callable prints is the output of the
+# run, followed by the line 'Call time: <seconds> secs' (to be extracted as any
+# other value, e.g. with 'Call time:\s+' in experiment_data).
+PREFIX = 'py:'
+TIME_LINE = "Call time: {0:.9f} secs\n"
+
+# garbage collection around the timed call (py_gc parameter)
+GC_ENABLED = 'enabled'
+GC_COLLECT = 'collect'      # full collection before the call
+GC_DISABLED = 'disabled'    # full collection, then disabled during the call
+GC_MODES = [ GC_ENABLED, GC_COLLECT, GC_DISABLED ]
+
+class Call:
+    """ Invocation of 'function' of 'module' with the arguments 'args' and
+    'kwargs'. The first time the worker executes the call it is repeated
+    'warmup' times, untimed and with the output discarded.
+
+    >>> c = parse('py:kernels:mat_mul 10 dtype=float 0.5')
+    >>> c.module, c.function, c.args, c.kwargs
+    ('kernels', 'mat_mul', [10, 0.5], {'dtype': 'float'})
+    """
+
+    def __init__(self, text, module, function, args, kwargs, warmup=0, gc=GC_ENABLED):
+        self.text = text
+        self.module = module
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.warmup = warmup
+        self.gc = gc
+
+    def request(self, out_file):
+        return { 'module': self.module, 'function': self.function, 'args': self.args,
+                 'kwargs': self.kwargs, 'warmup': self.warmup, 'gc': self.gc, 'out': out_file }
+
+    def __str__(self):
+        return self.text
+
+def is_call(cmd):
+    return isinstance(cmd, Call) or cmd.startswith(PREFIX)
+
+def parse(cmd, warmup=0, gc=GC_ENABLED):
+    tokens = shlex.split(cmd)
+    target = tokens[0][len(PREFIX):]
+    if target.count(':') != 1:
+        raise ValueError("Expected 'py:module:function' instead of '{0}'".format(tokens[0]))
+    (module, function) = target.split(':')
+    (args, kwargs) = ([], {})
+    for token in tokens[1:]:
+        if '=' in token:
+            (name, value) = token.split('=', 1)
+            kwargs[name] = convert(value)
+        else:
+            args.append( convert(token) )
+    if gc not in GC_MODES:
+        raise ValueError("py_gc must be one of {0}".format(", ".join(GC_MODES)))
+    return Call(cmd, module, function, args, kwargs, warmup, gc)
+
+def module_file(cmd):
+    """ The source file of the module of the call 'cmd', as found by the 
+    workers (which import from the working directory first), None when it is 
+    not found. The modules it imports in turn are not considered """
+    target = shlex.split(cmd)[0][len(PREFIX):]
+    path = [ os.getcwd() ] + sys.path
+    try:
+        for name in target.split(':')[0].split('.'):
+            (f, file_name, desc) = imp.find_module(name, path)
+            if f:
+                f.close()
+            path = [ file_name ]
+    except ImportError:
+        return None
+    if os.path.isdir(file_name):
+        file_name = os.path.join(file_name, '__init__.py')
+    return file_name if os.path.isfile(file_name) else None
+
+def from_section(cmd, conf):
+    """ Returns the Call of the (substituted) command 'cmd', using the py_warmup
+    and py_gc parameters of 'conf' """
+    params = conf.parameters
+    warmup = params['py_warmup'].currValue() if 'py_warmup' in params else 0
+    gc = params['py_gc'].currValue() if 'py_gc' in params else GC_ENABLED
+    return parse(cmd, warmup, gc)
+
+class Worker:
+    """ Client side of a worker process: requests are sent as JSON lines onto
+    its standard input, each one is answered by a JSON line """
+
+    def __init__(self):
+        script = os.path.abspath(__file__)
+        if script.endswith('.pyc'):
+            script = script[:-1]
+        self.__proc = subprocess.Popen( [ sys.executable, script ], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, preexec_fn=os.setpgrp )
+
+    def call(self, request, timeout=None):
+        """ Returns the reply of the worker, None when it did not answer within
+        'timeout' seconds (the worker is killed) or when it died; in the latter
+        case its wait status is returned as well """
+        try:
+            self.__proc.stdin.write( json.dumps(request) + '\n' )
+            self.__proc.stdin.flush()
+        except IOError:
+            return (None, self.__wait())
+        ready = select.select([ self.__proc.stdout ], [], [], timeout)[0]
+        if not ready:
+            self.kill()
+            return (None, None)
+        line = self.__proc.stdout.readline()
+        if not line:
+            return (None, self.__wait())
+        return (json.loads(line), None)
+
+    def __wait(self):
+        self.__proc.wait()
+        return self.__proc.returncode
+
+    def kill(self):
+        try:
+            os.killpg(self.__proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.__proc.wait()
+
+    def close(self):
+        if self.__proc.returncode is None:
+            self.__proc.stdin.close()
+            self.__proc.wait()
+
+# workers of each (process, thread), started on demand
+_workers = {}
+_lock = threading.Lock()
+
+def execute(call, kill_after=None):
+    """ Executes 'call' by the worker of the current thread, returns the name
+    of the file with its output (to be removed by the caller), the status
+    ('ok', 'failed', 'signalled' or 'timeout'), the exit code or signal and the
+    metrics of the call """
+    key = (os.getpid(), threading.current_thread().ident)
+    _lock.acquire()
+    worker = _workers.get(key)
+    if worker is None:
+        worker = _workers[key] = Worker()
+    _lock.release()
+    (fd, out_file) = tempfile.mkstemp(prefix='~call')
+    os.close(fd)
+    start = time.time()
+    (reply, wait_status) = worker.call(call.request(out_file), kill_after)
+    if reply is not None:
+        return (out_file, reply['status'], reply['code'], reply['metrics'])
+    # the worker was killed or died, it is replaced by the next call
+    _lock.acquire()
+    del _workers[key]
+    _lock.release()
+    metrics = { 'wall': time.time() - start }
+    if wait_status is None:
+        return (out_file, 'timeout', None, metrics)
+    if wait_status < 0:
+        return (out_file, 'signalled', -wait_status, metrics)
+    return (out_file, 'failed', wait_status, metrics)
+
+def shutdown():
+    _lock.acquire()
+    for (key, worker) in _workers.items():
+        if key[0] == os.getpid():
+            worker.close()
+    _workers.clear()
+    _lock.release()
+
+atexit.register(shutdown)
+
+def serve():
+    # loop of the worker process: the replies are written onto the original
+    # standard output, while the one of the callables is redirected onto the
+    # output file of each request
+    import gc, traceback, resource, metrics
+    replies = os.fdopen(os.dup(1), 'w')
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    sys.path.insert(0, os.getcwd())
+    timer = getattr(time, 'perf_counter_ns', None)
+    clock = (lambda: timer() / 1e9) if timer else (time.perf_counter if hasattr(time, 'perf_counter')
+                                                    else time.time)
+    (functions, warm) = ({}, set())
+
+    def redirect(fd):
+        sys.stdout.flush()
+        os.dup2(fd, 1)
+
+    for line in iter(sys.stdin.readline, ''):
+        request = json.loads(line)
+        out = os.open(request['out'], os.O_WRONLY | os.O_APPEND)
+        (status, code, elapsed) = ('ok', None, 0.0)
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            name = (request['module'], request['function'])
+            if name not in functions:
+                module = __import__(request['module'], fromlist=[ request['function'] ])
+                functions[name] = getattr(module, request['function'])
+            function = functions[name]
+            kwargs = dict([ (str(k), v) for (k, v) in request['kwargs'].items() ])
+            signature = json.dumps([ name, request['args'], sorted(kwargs.items()) ])
+            if signature not in warm:
+                for i in range(request['warmup']):
+                    function(*request['args'], **kwargs)
+                warm.add(signature)
+                before = resource.getrusage(resource.RUSAGE_SELF)
+
+            if request['gc'] != GC_ENABLED:
+                gc.collect()
+            if request['gc'] == GC_DISABLED:
+                gc.disable()
+            redirect(out)
+            try:
+                start = clock()
+                function(*request['args'], **kwargs)
+                elapsed = clock() - start
+            finally:
+                redirect(devnull)
+                gc.enable()
+            os.write(out, TIME_LINE.format(elapsed))
+        except (Exception, SystemExit):
+            traceback.print_exc()
+            (status, code) = ('failed', 1)
+        os.close(out)
+        after = resource.getrusage(resource.RUSAGE_SELF)
+        usage = metrics.from_rusage(after, elapsed)
+        for (name, field) in metrics.RUSAGE_FIELDS:
+            if name != 'max_rss':
+                usage[name] = getattr(after, field) - getattr(before, field)
+        replies.write( json.dumps({ 'status': status, 'code': code, 'metrics': usage }) + '\n' )
+        replies.flush()
+
+if __name__ == '__main__':
+    serve()
@@ -0,0 +1,329 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import os, sys, threading, atexit, sqlite3, optparse
+from array import array
+from collections import OrderedDict
+from util import gen_file_name
+from histogram import Histogram, decode
+
+# Results are of two kinds: the aggregated rows of the output file (CSV) of
+# the benchmark and the raw samples extracted from the output of each run
+# (stored in the '~' file of the output of the program). Both are written
+# through the store in use, which is either a set of text files or a SQLite
+# database. A sample can be made of histograms (the distribution of the values
+# found in the output of a run), which are stored in their text encoding.
+
+def format_row(values):
+    # histograms are written in their encoding (not formatted as their mean)
+    return ",".join( map(lambda x: str(x) if isinstance(x, Histogram) else "{0}".format(x), values) ) + "\n"
+
+class TextStore:
+    """ Stores the results onto text files, as comma separated values. The
+    files are kept open (at most MAX_OPEN of them) and written through a buffer
+    which is flushed each time a row is written, so that the samples of a
+    configuration reach the disk together with its aggregated row. """
+
+    MAX_OPEN = 64
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__files = OrderedDict()
+
+    def __file(self, file_name):
+        f = self.__files.pop(file_name, None)
+        if f is None:
+            if len(self.__files) >= TextStore.MAX_OPEN:
+                self.__files.popitem(last=False)[1].close()
+            f = open(file_name, 'a')
+        # the most recently used files are at the end
+        self.__files[file_name] = f
+        return f
+
+    def sample(self, out_file, values, run=None, iteration=None):
+        """ Stores the values extracted from a run whose output is 'out_file',
+        the samples of a run follow each other therefore the index of the run
+        and of the sample within the run are not written """
+        self.__lock.acquire()
+        self.__file( gen_file_name(out_file) ).write( format_row(values) )
+        self.__lock.release()
+
+    def row(self, file_name, values):
+        """ Appends a row of (already formatted) values to the file 'file_name' """
+        self.__lock.acquire()
+        self.__file( file_name ).write( ",".join(values) + "\n" )
+        self.flush()
+        self.__lock.release()
+
+    def samples(self, out_file):
+        """ Returns the samples stored for the output file 'out_file' """
+        self.flush()
+        data = []
+        if os.path.exists(gen_file_name(out_file)):
+            for line in open(gen_file_name(out_file)):
+                data.append([decode(x.strip()) for x in line.split(',')])
+        return data
+
+    def flush(self):
+        self.__lock.acquire()
+        for f in self.__files.values():
+            f.flush()
+        self.__lock.release()
+
+    def size(self, file_name):
+        """ Returns the size of the file, used by the journal to bring the
+        results back to a given point """
+        self.flush()
+        return os.path.getsize(file_name) if os.path.exists(file_name) else 0
+
+    def truncate(self, file_name, size):
+        if isinstance(size, dict):
+            # recorded by the SQLiteStore
+            size = size.get('bytes', 0)
+        self.__lock.acquire()
+        f = self.__files.pop(file_name, None)
+        if f is not None:
+            f.close()
+        if os.path.exists(file_name) and os.path.getsize(file_name) > size:
+            print "* Resume: truncating '{0}' to {1} bytes".format(file_name, size)
+            open(file_name, 'r+b').truncate(size)
+        self.__lock.release()
+
+    def close(self):
+        self.__lock.acquire()
+        for f in self.__files.values():
+            f.close()
+        self.__files.clear()
+        self.__lock.release()
+
+class SQLiteStore:
+    """ Stores the results in a SQLite database (in WAL mode). The rows of the
+    output files are kept in the 'rows' table, the samples in the 'samples'
+    table as arrays of doubles, therefore they are loaded without parsing any
+    text (samples made of histograms are stored as text instead), together
+    with the index of the run and of the sample within the run. All the writes
+    go through a single connection and are committed each time a row is
+    written (or COMMIT_EVERY samples are pending). The text files can be
+    produced from the database with export(). """
+
+    COMMIT_EVERY = 1000
+
+    def __init__(self, file_name):
+        self.__lock = threading.RLock()
+        self.__pending = 0
+        self.__db = sqlite3.connect(file_name, check_same_thread=False)
+        self.__db.text_factory = str
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.execute('PRAGMA mmap_size=268435456')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS rows (id INTEGER PRIMARY KEY, file TEXT, row TEXT)')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS samples (id INTEGER PRIMARY KEY, file TEXT, '
+                          'ints INTEGER, data BLOB, run INTEGER, iteration INTEGER, text TEXT)')
+        # databases written before the run and iteration indices were stored
+        columns = [ c[1] for c in self.__db.execute('PRAGMA table_info(samples)') ]
+        for column in [ 'run INTEGER', 'iteration INTEGER', 'text TEXT' ]:
+            if column.split()[0] not in columns:
+                self.__db.execute('ALTER TABLE samples ADD COLUMN ' + column)
+        self.__db.execute('CREATE INDEX IF NOT EXISTS rows_file ON rows (file)')
+        self.__db.execute('CREATE INDEX IF NOT EXISTS samples_file ON samples (file)')
+        self.__db.commit()
+
+    def sample(self, out_file, values, run=None, iteration=None):
+        # 'ints' is a bitmask of the integer values, to export them as they were
+        ints = sum([ 1 << i for i in range(len(values)) if isinstance(values[i], (int, long)) ])
+        (data, text) = (None, None)
+        if [ v for v in values if isinstance(v, Histogram) ]:
+            text = format_row(values)[:-1]
+        else:
+            data = buffer(array('d', values).tostring())
+        self.__lock.acquire()
+        self.__db.execute('INSERT INTO samples (file, ints, data, run, iteration, text) VALUES (?, ?, ?, ?, ?, ?)',
+                (gen_file_name(out_file), ints, data, run, iteration, text))
+        self.__pending += 1
+        if self.__pending >= SQLiteStore.COMMIT_EVERY:
+            self.flush()
+        self.__lock.release()
+
+    def row(self, file_name, values):
+        self.__lock.acquire()
+        self.__db.execute('INSERT INTO rows (file, row) VALUES (?, ?)', (file_name, ",".join(values)))
+        self.flush()
+        self.__lock.release()
+
+    def __samples(self, file_name):
+        data = []
+        for (ints, blob, text) in self.__db.execute('SELECT ints, data, text FROM samples WHERE file = ? '
+                                                    'ORDER BY id', (file_name,)):
+            if blob is None:
+                data.append([ decode(x) for x in text.split(',') ])
+                continue
+            values = array('d', str(blob)).tolist()
+            if ints:
+                values = [ int(values[i]) if ints & (1 << i) else values[i] for i in range(len(values)) ]
+            data.append(values)
+        return data
+
+    def samples(self, out_file):
+        self.__lock.acquire()
+        try:
+            return self.__samples( gen_file_name(out_file) )
+        finally:
+            self.__lock.release()
+
+    def flush(self):
+        self.__lock.acquire()
+        self.__db.commit()
+        self.__pending = 0
+        self.__lock.release()
+
+    def __count(self, table, file_name):
+        return self.__db.execute('SELECT count(*) FROM {0} WHERE file = ?'.format(table),
+                                 (file_name,)).fetchone()[0]
+
+    def __drop(self, table, file_name, size):
+        # drops the records of 'file_name' after the first 'size' ones, returns
+        # how many there were
+        count = self.__count(table, file_name)
+        if count > size:
+            print "* Resume: dropping {0} records of '{1}'".format(count - size, file_name)
+            self.__db.execute('DELETE FROM {0} WHERE id IN (SELECT id FROM {0} WHERE file = ? '
+                              'ORDER BY id LIMIT -1 OFFSET ?)'.format(table), (file_name, size))
+        return count
+
+    def size(self, file_name):
+        """ Returns the number of records stored for 'file_name' in each table
+        and the size of the file with the same name, if any (e.g. the output
+        of the programs), each one in its own unit
+
+        >>> import tempfile, shutil
+        >>> work = tempfile.mkdtemp()
+        >>> out = os.path.join(work, 'out.csv')
+        >>> open(out, 'w').write('a text file written before\\n')
+        >>> store = SQLiteStore(os.path.join(work, 'results.db'))
+        >>> size = store.size(out)
+        >>> sorted(size.items())
+        [('bytes', 27), ('rows', 0), ('samples', 0)]
+        >>> store.row(out, ['1', '2'])
+        >>> store.truncate(out, size) # doctest: +ELLIPSIS
+        * Resume: dropping 1 records of '...out.csv'
+        >>> store.size(out)['rows']
+        0
+        >>> shutil.rmtree(work)
+        """
+        self.__lock.acquire()
+        try:
+            self.flush()
+            size = { 'rows': self.__count('rows', file_name), 'samples': self.__count('samples', file_name) }
+            size['bytes'] = os.path.getsize(file_name) if os.path.exists(file_name) else 0
+            return size
+        finally:
+            self.__lock.release()
+
+    def truncate(self, file_name, size):
+        self.__lock.acquire()
+        try:
+            if isinstance(size, dict):
+                for table in [ 'rows', 'samples' ]:
+                    self.__drop(table, file_name, size.get(table, 0))
+                self.flush()
+                if os.path.exists(file_name) and os.path.getsize(file_name) > size.get('bytes', 0):
+                    print "* Resume: truncating '{0}' to {1} bytes".format(file_name, size['bytes'])
+                    open(file_name, 'r+b').truncate(size['bytes'])
+                return
+            # journals which recorded a single size: the records, or the bytes of
+            # the files not in the database
+            for table in [ 'rows', 'samples' ]:
+                count = self.__drop(table, file_name, size)
+                if count:
+                    self.flush()
+                    return
+            if os.path.exists(file_name) and os.path.getsize(file_name) > size:
+                print "* Resume: truncating '{0}' to {1} bytes".format(file_name, size)
+                open(file_name, 'r+b').truncate(size)
+        finally:
+            self.__lock.release()
+
+    def export(self, directory=None):
+        """ Writes the rows and the samples stored in the database onto text
+        files (below 'directory' when given), returns the names of the files """
+        self.__lock.acquire()
+        try:
+            exported = []
+            files = [ (file_name, 'rows') for (file_name,) in
+                        self.__db.execute('SELECT DISTINCT file FROM rows') ] + \
+                    [ (file_name, 'samples') for (file_name,) in
+                        self.__db.execute('SELECT DISTINCT file FROM samples') ]
+            for (file_name, table) in files:
+                dest = file_name
+                if directory:
+                    dest = os.path.join(directory, os.path.normpath(file_name).lstrip(os.sep))
+                if os.path.dirname(dest) and not os.path.isdir(os.path.dirname(dest)):
+                    os.makedirs(os.path.dirname(dest))
+                out = open(dest, 'w')
+                if table == 'rows':
+                    for (row,) in self.__db.execute('SELECT row FROM rows WHERE file = ? ORDER BY id',
+                                                    (file_name,)):
+                        out.write(row + "\n")
+                else:
+                    for values in self.__samples(file_name):
+                        out.write( format_row(values) )
+                out.close()
+                exported.append(dest)
+            return exported
+        finally:
+            self.__lock.release()
+
+    def close(self):
+        self.__lock.acquire()
+        if self.__db is not None:
+            self.__db.commit()
+            self.__db.close()
+            self.__db = None
+        self.__lock.release()
+
+# the store in use
+_store = TextStore()
+
+def use(store):
+    """ Sets the store where the results of the benchmark are written """
+    global _store
+    _store.close()
+    _store = store
+
+def get():
+    return _store
+
+# pending results are written when the benchmark terminates
+atexit.register(lambda: _store.close())
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] results.db")
+    parser.add_option("-d", "--dir", type="string", dest="directory",
+                      help=("Directory where the files are exported, by default they are "
+                            "written where the benchmark would have written them"))
+    (options, args) = parser.parse_args(argv)
+    if len(args) != 1 or not os.path.exists(args[0]):
+        parser.error("Error: a results database is expected")
+    store = SQLiteStore(args[0])
+    for file_name in store.export(options.directory):
+        print "Exported: {0}".format(file_name)
+    store.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
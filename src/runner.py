@@ -17,34 +17,29 @@
 
 '''
 
-from configuration import Configuration
+from configuration import Configuration, Schema
 from parameter import Parameter
 from iterator import CompoundConfigIterator, ConfigIterator, RandConfigIterator
 import config_parse, math
-import subprocess, time, shlex, re, sys, os
+import subprocess, time, shlex, re, sys, os, select, signal, shutil, tempfile, threading
 from util import *
+from extractor import extract_file
+import metrics, results, histogram, stats, random, noise, pycall
+from sge import submit, shared_monitor, sge_command, QSUB
 from copy import deepcopy
 
-def write(file, msg):
-    if file:
-        of = open(file, 'a')
-        of.write(msg)
-        of.close()
-    else:
-        print (msg)
-
-def extract(output, extracted_params):
-    rows = [ 0 ] * len(extracted_params)
-    for i in range(len(extracted_params)):
-        p = re.compile(extracted_params[i] + '\d+(\.\d+)?')
-        rows[i] = []
-        for it in p.finditer(output):
-            substring = it.group()
-            # print substring
-            p = re.compile('\d+(\.\d+)?')
-            rows[i].append( config_parse.convert(p.search(substring).group()) )
-    # return non empty rows
-    return zip(*rows)
+CHUNK_SIZE = 64 * 1024
+
+def append_file(src, dest):
+    # appends the content of file 'src' onto 'dest' (stdout when None) 
+    # and removes 'src'
+    inf = open(src, 'rb')
+    out = open(dest, 'ab') if dest else sys.stdout
+    shutil.copyfileobj(inf, out, CHUNK_SIZE)
+    inf.close()
+    if dest:
+        out.close()
+    os.remove(src)
 
 # Interface for Runners. 
 class Runner:
@@ -64,100 +59,701 @@ class DummyRunner(Runner):
             for cmd in cmd_list:
                 print (sobstitute(cmd, conf))
 
-def run_local(cmd, kill_after=None):
-    pid = subprocess.Popen( shlex.split(cmd), stdout=subprocess.PIPE )
-    if kill_after is None:
-        pid.wait()
-    else:
-        remaining = kill_after
-        while remaining > 0 and pid.poll() is None:
-            time.sleep(1)
-            remaining -= 1
-    if pid.poll() is None:
-        print ("* Killing process {0}".format(pid.pid))
-        pid.kill()
-    return pid.communicate()
+class RunStatus:
+    """ Outcome of a command executed by run_local, together with the resources
+    it used (see the metrics module). """
+    
+    OK = 'ok'
+    FAILED = 'failed'
+    SIGNALLED = 'signalled'
+    TIMEOUT = 'timeout'
+    
+    def __init__(self, status, code=None, metrics=None):
+        self.status = status
+        # exit code (for FAILED) or signal number (for SIGNALLED)
+        self.code = code
+        self.metrics = metrics or {}
+    
+    @staticmethod
+    def fromWaitStatus(wait_status):
+        if os.WIFSIGNALED(wait_status):
+            return RunStatus(RunStatus.SIGNALLED, os.WTERMSIG(wait_status))
+        code = os.WEXITSTATUS(wait_status)
+        return RunStatus(RunStatus.OK if code == 0 else RunStatus.FAILED, code)
+        
+    def ok(self):
+        return self.status == RunStatus.OK
+    
+    def __str__(self):
+        if self.code is None or self.status in (RunStatus.OK, RunStatus.TIMEOUT):
+            return self.status
+        return "{0}({1})".format(self.status, self.code)
+
+class ExitWatcher:
+    """ Provides a file descriptor which becomes readable as soon as the process 
+    'pid' terminates, so that its termination can be waited together with its 
+    output. A pidfd is used when available, otherwise a thread reaps the process 
+    and signals it through a pipe. The process is reaped by wait4, its resource
+    usage is available afterwards as 'rusage'. """
+    
+    def __init__(self, pid):
+        self.__pid = pid
+        self.__wait_status = None
+        self.rusage = None
+        if hasattr(os, 'pidfd_open'):
+            self.fd = os.pidfd_open(pid)
+            self.__reaper = None
+        else:
+            import threading
+            (self.fd, self.__notify) = os.pipe()
+            self.__reaper = threading.Thread(target=self.__reap)
+            self.__reaper.daemon = True
+            self.__reaper.start()
+            
+    def __reap(self):
+        (_, self.__wait_status, self.rusage) = os.wait4(self.__pid, 0)
+        os.write(self.__notify, 'x')
+        os.close(self.__notify)
+    
+    def waitStatus(self):
+        """ Returns the wait status of the terminated process. """
+        if self.__reaper is None:
+            (_, self.__wait_status, self.rusage) = os.wait4(self.__pid, 0)
+        else:
+            self.__reaper.join()
+        os.close(self.fd)
+        return self.__wait_status
+
+def kill_group(pgid):
+    try:
+        os.killpg(pgid, signal.SIGKILL)
+    except OSError:
+        # the whole group already terminated
+        pass
+
+def run_local(cmd, kill_after=None, out=None, extractor=None, cgroup=None):
+    """ Executes 'cmd' and returns its output and its RunStatus. When 'kill_after' 
+    seconds elapse before the command terminates, the whole process group of the 
+    command is killed. 
+    The output is read in chunks of CHUNK_SIZE bytes: when the file object 'out' 
+    is given the chunks are written onto it (and None is returned as output) 
+    instead of being collected in memory, 'extractor' is fed with every chunk. 
+    When 'cgroup' is given the command is executed in a transient cgroup created
+    below it, whose statistics are added to the metrics of the run. """
+    group = metrics.transient_cgroup(cgroup) if cgroup else None
+    def setup():
+        # the command leads its own process group, so that on timeout the 
+        # processes it spawned are killed as well
+        os.setpgrp()
+        if group and not group.join():
+            # the run goes ahead without the cgroup (stdout is the output of the run)
+            os.write(2, "* Cannot join the cgroup '{0}', the run is not accounted\n".format(group.path))
+    try:
+        start = time.time()
+        pid = subprocess.Popen( shlex.split(cmd), stdout=subprocess.PIPE, preexec_fn=setup )
+        watcher = ExitWatcher(pid.pid)
+    
+        deadline = None if kill_after is None else time.time() + kill_after
+        out_fd = pid.stdout.fileno()
+        waiting = [ out_fd, watcher.fd ]
+        chunks = []
+        timed_out = False
+        while waiting:
+            timeout = None
+            if deadline is not None:
+                timeout = max(0, deadline - time.time())
+            ready = select.select(waiting, [], [], timeout)[0]
+            if not ready:
+                print ("* Killing process group {0}".format(pid.pid))
+                kill_group(pid.pid)
+                timed_out = True
+                deadline = None
+                continue
+            if out_fd in ready:
+                chunk = os.read(out_fd, CHUNK_SIZE)
+                if chunk:
+                    if extractor:
+                        extractor.feed(chunk)
+                    if out:
+                        out.write(chunk)
+                    else:
+                        chunks.append( chunk )
+                else:
+                    waiting.remove(out_fd)
+            if watcher.fd in ready:
+                waiting.remove(watcher.fd)
+            
+        pid.stdout.close()
+        pid.returncode = watcher.waitStatus()
+        status = RunStatus(RunStatus.TIMEOUT) if timed_out else RunStatus.fromWaitStatus(pid.returncode)
+        status.metrics = metrics.from_rusage(watcher.rusage, time.time() - start)
+        if group:
+            status.metrics.update( group.metrics() )
+    finally:
+        if group:
+            group.remove()
+    return (None if out else "".join(chunks), status)
+
+def run_python(call, kill_after=None, out=None, extractor=None):
+    """ Executes the pycall.Call 'call' by the worker process of the current
+    thread, the output is handled as the one of run_local. """
+    (call_out, status, code, call_metrics) = pycall.execute(call, kill_after)
+    if status == RunStatus.TIMEOUT:
+        print ("* Killing the worker of {0}".format(call))
+    chunks = []
+    inf = open(call_out, 'rb')
+    for chunk in iter(lambda: inf.read(CHUNK_SIZE), ''):
+        if extractor:
+            extractor.feed(chunk)
+        if out:
+            out.write(chunk)
+        else:
+            chunks.append( chunk )
+    inf.close()
+    os.remove(call_out)
+    return (None if out else "".join(chunks), RunStatus(status, code, call_metrics))
+
+def prepare_command(cmd, cconf):
+    """ Returns the command 'cmd' for the configuration 'cconf' (a pycall.Call
+    for the Python callables) and the file its output is appended to ('>>'), 
+    None for stdout """
+    out_file = None
+    curr_cmd = sobstitute(cmd, cconf)
+    
+    curr_cmd = curr_cmd.replace('\\\n','')
+    if curr_cmd.find('>>') != -1:
+        out_file = curr_cmd[curr_cmd.rfind('>>')+2:].strip()
+        curr_cmd = curr_cmd[:curr_cmd.rfind('>>')].strip()
+    if pycall.is_call(curr_cmd):
+        curr_cmd = pycall.from_section(curr_cmd, cconf)
+    return (curr_cmd, out_file)
+
+def store_data(out_file, samples, run=None):
+    # writes the samples extracted from the output stored in 'out_file' (by
+    # the run 'run') onto the corresponding raw ('~') file
+    sys.stdout.write("Extracting data... ")
+    for values in samples:
+        print ", ".join(  map(lambda x: "{0:.3f}".format(x), values) )
+    print "Writing results onto file: {0}".format(out_file)
+    for i in range(len(samples)):
+        results.get().sample(out_file, samples[i], run, i)
+
+class Convergence:
+    """ Stopping criterion of the adaptive repetition mode: runs are repeated 
+    until the 95% confidence interval of the mean of the 'column'-th extracted
+    value is within 'target' (relative half-width), with at least 'min_runs' 
+    and at most 'max_runs' runs """
+    
+    def __init__(self, min_runs, max_runs, column, target):
+        self.min_runs = min_runs
+        self.max_runs = max_runs
+        self.column = column
+        self.target = target
+    
+    def reached(self, runs, data):
+        if runs >= self.max_runs:
+            return True
+        if runs < self.min_runs:
+            return False
+        values = [ row[self.column] for row in data if len(row) > self.column ]
+        # the distribution of a run is represented by its mean
+        values = [ v.mean() if isinstance(v, histogram.Histogram) else v for v in values ]
+        return len(values) > 1 and rel_ci95(values) <= self.target
+        
+def get_convergence(cconf, elaborate):
+    """ Returns the Convergence criterion when the adaptive repetition mode is 
+    enabled (by the 'ci_target' parameter) for the configuration 'cconf' """
+    params = cconf.parameters.keys()
+    if 'ci_target' not in params:
+        return None
+    in_file_format = elaborate.in_file_format.values
+    column = 0
+    if 'ci_column' in params:
+        assert cconf.ci_column.currValue() in in_file_format, \
+            "ci_column '{0}' is not in in_file_format".format(cconf.ci_column.currValue())
+        column = in_file_format.index( cconf.ci_column.currValue() )
+    max_runs = cconf.max_runs.currValue() if 'max_runs' in params else cconf.num_of_runs.currValue()
+    min_runs = cconf.min_runs.currValue() if 'min_runs' in params else min(3, max_runs)
+    return Convergence(min_runs, max_runs, column, cconf.ci_target.currValue())
+
+def run_samples(curr_run):
+    # samples extracted by the commands of a run, none when the run was 
+    # rejected by the noise guard
+    return [ values for (_, _, ext_data, status) in curr_run if not status.metrics.get('rejected')
+                for values in ext_data or [] ]
+
+def run_rejected(curr_run):
+    return any([ status.metrics.get('rejected') for (_, _, _, status) in curr_run ])
+
+def run_pack(cmds, num_of_runs, kill_after=None, extractor=None, verbose=True, store=True, convergence=None,
+             previous=None, on_run=None, cgroup=None, guard=None):
+    """ Executes 'num_of_runs' times the list of (command, out_file) pairs 'cmds'. 
+    The output of each command is streamed onto its out_file (stdout when None).
+    When 'store' is False the outputs are written onto temporary files instead
+    (this is the case for the parallel workers which must not write onto shared 
+    files) and it's up to the caller to append them to the out_file. 
+    Returns a list with an entry for each run, each entry is a list of 
+    (temporary file, out_file, extracted samples, RunStatus) tuples. The 
+    samples extracted by commands which did not terminate successfully are 
+    discarded. 
+    When a 'convergence' criterion is given the runs stop as soon as it is 
+    reached (num_of_runs being the maximum number of runs). 
+    'previous' are the results of runs already executed (when resuming), the 
+    execution continues from the following run. 'on_run' is called with the 
+    number and the results of each run once completed. 
+    'cgroup' is the parent of the transient cgroups of the runs, if any (it 
+    does not apply to the pycall.Call commands, executed by a worker process). 
+    The noise 'guard', if any, is checked before each run and its metrics are 
+    recorded with the ones of the commands. """
+    results = list(previous or [])
+    data = [ values for curr_run in results for values in run_samples(curr_run) ]
+    if results and convergence and convergence.reached(len(results), data):
+        return results
+    for n in range(len(results), num_of_runs):
+        if verbose:
+            print "~~ RUN #{0} ~~".format(n+1)
+        noise_state = guard.wait() if guard else {}
+        rejected = guard is not None and guard.reject and noise_state['noisy']
+        if rejected:
+            noise_state['rejected'] = 1
+        curr_run = []
+        for (cmd, out_file) in cmds:
+            tmp_file = None
+            if store:
+                out = open(out_file, 'ab') if out_file else sys.stdout
+            else:
+                (fd, tmp_file) = tempfile.mkstemp(prefix='~', 
+                        dir=os.path.dirname(out_file) if out_file else None)
+                out = os.fdopen(fd, 'wb')
+            stream = None
+            if extractor and out_file:
+                stream = extractor.stream()
+            try:
+                if isinstance(cmd, pycall.Call):
+                    status = run_python(cmd, kill_after, out, stream)[1]
+                else:
+                    status = run_local(cmd, kill_after, out, stream, cgroup)[1]
+            finally:
+                if out is sys.stdout:
+                    out.flush()
+                else:
+                    out.close()
+            
+            status.metrics.update(noise_state)
+            ext_data = None
+            if not status.ok():
+                print "* Command failed: {0} ({1})".format(cmd, status)
+            elif stream:
+                ext_data = stream.close() or None
+            if store and ext_data:
+                store_data(out_file, ext_data, n)
+            if ext_data is not None and not rejected:
+                data.extend( ext_data )
+            curr_run.append( (tmp_file, out_file, ext_data, status) )
+        results.append( curr_run )
+        if on_run:
+            on_run(n, curr_run)
+        
+        if len(data) == 0 and not rejected:
+            # it means the first run failed, so it means this configuration is not working
+            break
+        if convergence and convergence.reached(n+1, data):
+            if verbose and n+1 < num_of_runs:
+                print "* Confidence interval converged after {0} runs".format(n+1)
+            break
+    return results
+
+def _pin_worker(core_groups):
+    # initializer of the worker processes of the parallel LocalRunner, each
+    # worker takes a distinct group of cores
+    pin_to_cores( core_groups.get() )
+
+def _run_pack(args):
+    # the exceptions are returned, so that the callback of the job is always
+    # invoked (see LocalRunner.__run_parallel)
+    try:
+        return run_pack(*args)
+    except Exception, err:
+        return err
+
+def lookup_cache(cache, cmd_list, cconf):
+    """ Returns the key of the configuration 'cconf' in the result cache and 
+    the (data, failures, runs, metrics) stored for it, if any """
+    if cache is None:
+        return (None, None)
+    key = cache.key(cmd_list, cconf)
+    cached = cache.lookup(key)
+    if cached is None:
+        return (key, None)
+    print "* Results found in the cache ({0})".format(key)
+    failures = [ RunStatus(status, code) for (status, code) in cached['failures'] ]
+    return (key, (decode_samples(cached['data']), failures, cached['runs'], cached.get('metrics', [])))
+
+def store_cache(cache, key, data, failures, runs, metrics=None):
+    if cache is not None and key is not None:
+        cache.store(key, encode_samples(data), [ (f.status, f.code) for f in failures ], runs, metrics)
+
+def encode_samples(samples):
+    # samples stored as JSON (cache and journal)
+    return [ map(histogram.encode, values) for values in samples ]
+
+def decode_samples(samples):
+    return [ tuple(map(histogram.decode, values)) for values in samples ]
+
+def run_metrics(results):
+    # metrics of the commands whose output is stored, for each successful run
+    return [ status.metrics for curr_run in results 
+                for (_, out_file, _, status) in curr_run if out_file and status.ok() and status.metrics ]
+
+def output_files(cmds, cconf, elaborate):
+    # files written during the evaluation of a configuration
+    files = []
+    for (_, out_file) in cmds:
+        if out_file:
+            files += [ out_file, gen_file_name(out_file) ]
+    if elaborate is not None:
+        files.append( sobstitute(elaborate.out_file_name.currValue(), cconf) )
+    return files
+
+def journal_begin(journal, cconf, files):
+    """ Registers the configuration 'cconf' in the journal, returns its 
+    identifier and, if it was already completed, its journal record """
+    if journal is None:
+        return (None, None)
+    ident = journal.begin(cconf, files)
+    completed = journal.completed(ident)
+    if completed:
+        print "* Configuration already completed (resume)"
+    return (ident, completed)
+
+def journal_runs(journal, ident, cmds):
+    # results of the runs already completed according to the journal
+    if journal is None:
+        return []
+    return [ [ (None, cmds[i][1], decode_samples(ext_data) if ext_data else None, RunStatus(status, code, metrics)) 
+                    for (i, (ext_data, status, code, metrics)) in enumerate(curr_run) ] 
+                for curr_run in journal.completedRuns(ident) ]
+
+def journal_run(journal, ident, n, curr_run, files):
+    if journal is not None:
+        journal.run(ident, n, [ (encode_samples(ext_data) if ext_data else None, status.status, status.code, status.metrics) 
+                                  for (_, _, ext_data, status) in curr_run ], files)
+
+def run_means(results, width):
+    # average values of each run (None for the runs without samples)
+    means = []
+    for curr_run in results:
+        samples = run_samples(curr_run)
+        means.append( stats.Summary(samples, width).all('AVG') if samples else None )
+    return means
+
+# orders of the runs of the interleaved mode (see LocalRunner)
+ROUND_ROBIN = 'round-robin'
+RANDOM = 'random'
+
+class Interleaved:
+    """ State of a configuration evaluated in the interleaved mode """
+    
+    def __init__(self, id, conf, cconf, cmd_list):
+        self.id = id
+        self.conf = conf
+        self.cconf = cconf
+        self.cmd_list = cmd_list
+        self.results = []
+        self.active = True
+        self.ret = None
 
 class LocalRunner(Runner):
-    def __init__(self, iter, extracted_params=None, elaborate=None):
+    """ Executes the configurations on the local machine, all the runs of a 
+    configuration one after the other. With 'interleave' the configurations
+    of a sweep (and the default one) are evaluated together, by rounds: each 
+    round executes a run of every configuration, in the iteration order 
+    (ROUND_ROBIN) or in a random order (RANDOM), so that a drift of the 
+    machine affects all of them alike. The speedup of a configuration is then
+    computed from the runs paired with the ones of the default configuration 
+    executed in the same round. """
+    
+    def __init__(self, iter, extractor=None, elaborate=None, jobs=1, cache=None, journal=None, interleave=None):
         Runner.__init__(self, iter)
-        self.__extract = extracted_params
+        self.__extract = extractor
         self.__elaborate = elaborate
+        self.__jobs = jobs
+        self.__cache = cache
+        self.__journal = journal
+        self.__interleave = interleave
+        
+    def __prepare(self, cmd_list, cconf, init):
+        kill_after = None
+        if 'kill_after' in cconf.parameters.keys():
+            kill_after = cconf.kill_after.currValue() if not init else None
+        (cgroup, guard) = (None, None)
+        if 'cgroup' in cconf.parameters.keys() and not init:
+            cgroup = cconf.cgroup.currValue()
+        if not init:
+            guard = noise.from_section(cconf)
+        
+        final_out_file = None
+        cmds = []
+        for cmd in cmd_list:
+            (curr_cmd, out_file) = prepare_command(cmd, cconf)
+            if out_file is not None:
+                final_out_file = out_file
+            cmds.append( (curr_cmd, out_file) )
+            
+        convergence = None
+        num_of_runs = 1
+        if not init:
+            num_of_runs = cconf.num_of_runs.currValue()
+            convergence = get_convergence(cconf, self.__elaborate)
+            if convergence:
+                num_of_runs = convergence.max_runs
+        return (cmds, num_of_runs, kill_after, final_out_file, convergence, cgroup, guard)
+    
+    def __finalize(self, conf, cconf, results, final_out_file, def_vals, key=None, ident=None, paired=None):
+        data = []
+        failures = []
+        for curr_run in results:
+            data += run_samples(curr_run)
+            failures += [ status for (_, _, _, status) in curr_run if not status.ok() ][:1]
+        metrics = run_metrics(results)
+        if results:
+            store_cache(self.__cache, key, data, failures, len(results), metrics)
+        return self.__writeBack(conf, cconf, (data, failures, len(results), metrics), final_out_file, 
+                                def_vals, ident, paired)
+    
+    def __writeBack(self, conf, cconf, result, final_out_file, def_vals, ident=None, paired=None):
+        (data, failures, runs, metrics) = result
+        ret = cconf.WriteBack(def_vals, data, final_out_file, self.__elaborate, failures, runs, metrics,
+                              paired)
+        conf.setSpeedup( cconf.getSpeedup() )
+        if self.__journal is not None and ident is not None:
+            self.__journal.finish(ident, cconf.getSpeedup(), ret, 
+                    [ sobstitute(self.__elaborate.out_file_name.currValue(), cconf) ])
+        return ret
+        
+    def run(self, cmd_list, paren_conf=None, init=False, def_vals=None, reference=None):
+        """ Evaluates the configurations of the iterator, 'reference' is the 
+        (commands, configuration) pair of the default configuration evaluated
+        together with them in the interleaved mode """
+        if self.__interleave and not init:
+            return self.__run_interleaved(cmd_list, paren_conf, def_vals, reference)
+        if self.__jobs > 1 and not init:
+            return self.__run_parallel(cmd_list, paren_conf, def_vals)
         
-    def run(self, cmd_list, paren_conf=None, init=False, def_vals=None):
         ret = None
         for conf in self.iter:
-        #    for conf in confs:
-            # print conf
             if not init: 
                 print "----> new configuration <----"
             
-            final_out_file = None
             ret = None
             
             cconf = conf
             if paren_conf is not None:
                 cconf = paren_conf + conf
                 
-            data = []
-            kill_after = None
-            if 'kill_after' in cconf.parameters.keys():
-                kill_after = cconf.kill_after.currValue() if not init else None
+            (cmds, num_of_runs, kill_after, final_out_file, convergence, cgroup, guard) = \
+                    self.__prepare(cmd_list, cconf, init)
+            if init:
+                run_pack(cmds, num_of_runs, kill_after, self.__extract, False)
+                continue
             
-            for n in range(cconf.num_of_runs.currValue()):
-                if not init:
-                    print "~~ RUN #{0} ~~".format(n+1)
-                for cmd in cmd_list:
-                    out_file = None
-                    curr_cmd = sobstitute(cmd, cconf)
-                    
-                    curr_cmd = curr_cmd.replace('\\\n','')
-                    if curr_cmd.find('>>') != -1:
-                        out_file = curr_cmd[curr_cmd.rfind('>>')+2:].strip()
-                        curr_cmd = curr_cmd[:curr_cmd.rfind('>>')].strip()
-                        final_out_file = out_file
-                    
-                    curr_data = self.__run_local( curr_cmd, out_file, kill_after)
-                    if(curr_data and len(curr_data) > 0):
-                        data.append( curr_data )
-                    
-                if init:
-                    break
-                
-                if len(data) == 0:
-                    # it means the first run failed, so it means this configuration is not working
-                    break
-                    
-            if not init:
-                ret = cconf.WriteBack(def_vals, data, final_out_file, self.__elaborate)
-                conf.setSpeedup( cconf.getSpeedup() )
+            files = output_files(cmds, cconf, self.__elaborate)
+            (ident, completed) = journal_begin(self.__journal, cconf, files)
+            if completed:
+                conf.setSpeedup( completed['speedup'] )
+                ret = completed['res']
+                continue
+            
+            (key, cached) = lookup_cache(self.__cache, cmd_list, cconf)
+            if cached:
+                ret = self.__writeBack(conf, cconf, cached, final_out_file, def_vals, ident)
+                continue
+            
+            on_run = None
+            if self.__journal is not None:
+                on_run = lambda n, curr_run: journal_run(self.__journal, ident, n, curr_run, files)
+            results = run_pack(cmds, num_of_runs, kill_after, self.__extract, True, True, convergence,
+                               journal_runs(self.__journal, ident, cmds), on_run, cgroup, guard)
+            ret = self.__finalize(conf, cconf, results, final_out_file, def_vals, key, ident)
                 
         return ret
     
-    def __run_local(self, cmd, out_file=None, kill_after=None):
-        data = run_local(cmd, kill_after)[0] 
+    def __begin(self, ev):
+        # prepares the evaluation 'ev', returns False when its results are
+        # already known (journal or cache)
+        (ev.cmds, ev.num_of_runs, ev.kill_after, ev.final_out_file, ev.convergence, ev.cgroup, ev.guard) = \
+                self.__prepare(ev.cmd_list, ev.cconf, False)
+        ev.files = output_files(ev.cmds, ev.cconf, self.__elaborate)
+        (ev.ident, ev.completed) = journal_begin(self.__journal, ev.cconf, ev.files)
+        (ev.key, ev.cached) = (None, None)
+        if ev.completed:
+            return False
+        (ev.key, ev.cached) = lookup_cache(self.__cache, ev.cmd_list, ev.cconf)
+        if ev.cached:
+            return False
+        ev.results = journal_runs(self.__journal, ev.ident, ev.cmds)
+        ev.active = not self.__done(ev)
+        return True
+    
+    def __done(self, ev):
+        # the evaluation is over when all the runs were executed, when the 
+        # first run failed or when the convergence was reached
+        data = [ values for curr_run in ev.results for values in run_samples(curr_run) ]
+        accepted = [ curr_run for curr_run in ev.results if not run_rejected(curr_run) ]
+        return len(ev.results) >= ev.num_of_runs or (len(accepted) > 0 and len(data) == 0) or \
+                (ev.convergence is not None and len(ev.results) > 0 and ev.convergence.reached(len(ev.results), data))
+    
+    def __runOnce(self, ev):
+        # executes the next run of 'ev'
+        on_run = None
+        if self.__journal is not None:
+            on_run = lambda n, curr_run: journal_run(self.__journal, ev.ident, n, curr_run, ev.files)
+        executed = len(ev.results)
+        ev.results = run_pack(ev.cmds, executed+1, ev.kill_after, self.__extract, True, True, ev.convergence,
+                              ev.results, on_run, ev.cgroup, ev.guard)
+        ev.active = len(ev.results) > executed and not self.__done(ev)
+    
+    def __finish(self, ev, def_vals, reference=None):
+        if ev.completed:
+            ev.conf.setSpeedup( ev.completed['speedup'] )
+            return ev.completed['res']
+        if ev.cached:
+            return self.__writeBack(ev.conf, ev.cconf, ev.cached, ev.final_out_file, def_vals, ev.ident)
+        paired = None
+        if reference is not None and reference.results:
+            width = len(self.__elaborate.in_file_format)
+            paired = [ (d, v) for (d, v) in zip(run_means(reference.results, width), run_means(ev.results, width))
+                                if d is not None and v is not None ]
+        return self.__finalize(ev.conf, ev.cconf, ev.results, ev.final_out_file, def_vals, ev.key, ev.ident, 
+                               paired)
+    
+    def __run_interleaved(self, cmd_list, paren_conf, def_vals, reference):
+        evaluations = []
+        ref = None
+        if reference is not None:
+            ref = Interleaved('default', reference[1], reference[1], reference[0])
+            evaluations.append(ref)
+        for (i, conf) in enumerate(self.iter):
+            cconf = deepcopy(conf) if paren_conf is None else paren_conf + conf
+            evaluations.append( Interleaved('#{0}'.format(i+1), conf, cconf, cmd_list) )
         
-        if self.__extract and out_file:
-            ext_data = extract( data, self.__extract )
-            if len(ext_data) > 0:
-                ext_data = ext_data[0]
-                sys.stdout.write("Extracting data... ")
-                print ", ".join(  map(lambda x: "{0:.3f}".format(x), ext_data) )
-                print "Writing results onto file: {0}".format(out_file)
-                write( out_file, data )
-                write( gen_file_name(out_file) , 
-                       ",".join( map(lambda x: "{0}".format(x), ext_data)) + '\n' )
-            else:
-                write( out_file, data )
-            return ext_data
-        if out_file is None:
-            print data
+        pending = [ ev for ev in evaluations if self.__begin(ev) and ev.active ]
+        print "* Interleaving the runs of {0} configurations ({1})".format(len(pending), self.__interleave)
+        n = 0
+        while pending:
+            if self.__interleave == RANDOM:
+                random.shuffle(pending)
+            for ev in pending:
+                # runs executed before resuming are not repeated
+                if len(ev.results) <= n:
+                    print "----> configuration {0} <----".format(ev.id)
+                    self.__runOnce(ev)
+            pending = [ ev for ev in pending if ev.active ]
+            n += 1
+        
+        if ref is not None:
+            print "----> default configuration <----"
+            def_vals = self.__finish(ref, None)
+            evaluations.remove(ref)
+        ret = None
+        for ev in evaluations:
+            print "----> new configuration <----"
+            ret = self.__finish(ev, def_vals, ref)
+        return ret
+    
+    def __run_parallel(self, cmd_list, paren_conf, def_vals):
+        import multiprocessing, threading, Queue
+        
+        groups = core_groups(self.__jobs)
+        print "* Running {0} configurations in parallel, cores: {1}".format(len(groups), 
+                " | ".join( map(lambda g: ",".join(map(str, g)), groups) ))
+        
+        free_groups = multiprocessing.Queue()
+        for group in groups:
+            free_groups.put( group )
+        pool = multiprocessing.Pool(len(groups), _pin_worker, (free_groups,))
+        
+        # configurations are submitted to the pool in the iteration order and 
+        # the results are collected (and written back) in the very same order 
+        # by a separate thread, this way iterators which block waiting for the
+        # speedup of a batch of configurations (i.e. the search iterators) keep 
+        # working. A slot is held by each job until it terminates, rather than
+        # until it is collected, so that a configuration slower than the 
+        # following ones does not leave the workers idle
+        pending = Queue.Queue()
+        slots = threading.Semaphore(2 * len(groups))
+        ret = [ None ]
+        
+        def collect():
+            while True:
+                item = pending.get()
+                if item is None:
+                    return
+                (conf, cconf, final_out_file, job, key, cached, ident, completed, previous, files) = item
+                if completed:
+                    conf.setSpeedup( completed['speedup'] )
+                    ret[0] = completed['res']
+                    continue
+                if cached:
+                    print "----> new configuration <----"
+                    ret[0] = self.__writeBack(conf, cconf, cached, final_out_file, def_vals, ident)
+                    continue
+                try:
+                    results = job.get()
+                except Exception, err:
+                    results = err
+                if isinstance(results, Exception):
+                    print "ERROR executing configuration: {0}".format(results)
+                    results = []
+                print "----> new configuration <----"
+                for n in range(len(results)):
+                    if n < len(previous):
+                        # executed before resuming
+                        continue
+                    for (tmp_file, out_file, ext_data, _) in results[n]:
+                        append_file(tmp_file, out_file)
+                        if ext_data:
+                            store_data(out_file, ext_data, n)
+                    journal_run(self.__journal, ident, n, results[n], files)
+                ret[0] = self.__finalize(conf, cconf, results, final_out_file, def_vals, key, ident)
+            
+        collector = threading.Thread(target=collect)
+        collector.start()
+        try:
+            for conf in self.iter:
+                # the iterator may modify the configuration in place, therefore we 
+                # take a copy of it
+                cconf = deepcopy(conf) if paren_conf is None else paren_conf + conf
+                (cmds, num_of_runs, kill_after, final_out_file, convergence, cgroup, guard) = \
+                        self.__prepare(cmd_list, cconf, False)
+                
+                files = output_files(cmds, cconf, self.__elaborate)
+                (ident, completed) = journal_begin(self.__journal, cconf, files)
+                (key, cached) = (None, None)
+                if not completed:
+                    (key, cached) = lookup_cache(self.__cache, cmd_list, cconf)
+                previous = journal_runs(self.__journal, ident, cmds)
+                
+                job = None
+                if not completed and not cached:
+                    slots.acquire()
+                    job = pool.apply_async(_run_pack, 
+                            ((cmds, num_of_runs, kill_after, self.__extract, False, False, convergence, 
+                              previous, None, cgroup, guard),), callback=lambda results: slots.release())
+                pending.put( (conf, cconf, final_out_file, job, key, cached, ident, completed, previous, files) )
+        finally:
+            pending.put( None )
+            collector.join()
+            pool.close()
+            pool.join()
+        return ret[0]
 
 class ExtractRunner(Runner):
     
-    def __init__(self, iter, elaborate=None):
+    def __init__(self, iter, elaborate=None, cache=None):
         Runner.__init__(self, iter)
         self.__elaborate = elaborate
+        self.__cache = cache
         
     def run(self, cmd_list, paren_conf=None, init=False, def_vals=None):
         ret = None
@@ -167,6 +763,8 @@ class ExtractRunner(Runner):
             cconf = conf
             if paren_conf is not None:
                 cconf = paren_conf + conf
+            
+            (key, cached) = lookup_cache(self.__cache, cmd_list, cconf)
                 
             for cmd in cmd_list:
                 out_file = None
@@ -178,34 +776,70 @@ class ExtractRunner(Runner):
                     curr_cmd = curr_cmd[:curr_cmd.rfind('>>')].strip()
                     final_out_file = out_file
                     
-                if out_file:
-                    data = []
-                    if os.path.exists(gen_file_name(out_file)):
-                        for line in open(gen_file_name(out_file)):
-                            data.append([convert(x.strip()) for x in line.split(',')])
+                if out_file and cached:
+                    (data, failures, runs, metrics) = cached
+                    ret = cconf.WriteBack(def_vals, data, out_file, self.__elaborate, failures, runs, metrics)
+                elif out_file:
+                    data = results.get().samples(out_file)
 
                     ret = cconf.WriteBack(def_vals, data, out_file, self.__elaborate)
                 
         return ret
 
+class SGEEvaluation:
+    """ State of a configuration being evaluated on SGE, the configuration is
+    kept as a point of the search space (many evaluations can be outstanding)
+    and rebuilt when needed """
+    
+    def __init__(self, conf, point, script, pack, id, out_file, def_vals, key, ident):
+        self.conf = conf
+        self.point = point
+        self.script = script
+        self.pack = pack
+        self.id = id
+        self.out_file = out_file
+        self.def_vals = def_vals
+        self.key = key
+        self.ident = ident
+        # runs executed so far and runs of the job in execution
+        self.runs = 0
+        self.batch = 0
+        self.failures = []
+        self.ret = None
+        self.done = threading.Event()
+    
+    def configuration(self):
+        return self.point.configuration()
+
 class SGERunner(Runner):
+    """ Executes the configurations on a Sun Grid Engine cluster. Jobs are
+    submitted without waiting for the previous ones to complete (unless 'wait'
+    is set) and their termination is detected by the monitor shared by all the
+    runners, which polls qstat for all the outstanding jobs at once. 
+    When 'array' is set all the configurations are submitted as the tasks of a
+    single array job (the iterator must not depend on the results). """
     
-    def __init__(self, iter, sge, use_thread_pool=True, extracted_params=None, elaborate=None):
+    def __init__(self, iter, sge, wait=False, extractor=None, elaborate=None, cache=None,
+                 journal=None, array=False):
         Runner.__init__(self, iter)  
-        self.__extract = extracted_params
-        self.__use_thread_pool = use_thread_pool
+        self.__extract = extractor
+        self.__cache = cache
+        self.__journal = journal
+        self.__wait = wait
+        self.__array = array and not wait
         self.__elaborate = elaborate
         self.__sge = sge
+        self.__qsub = sge_command(sge, 'qsub', QSUB)
+        self.__monitor = shared_monitor(sge)
     
     def run(self, cmd_list, paren_conf=None, init=False, def_vals=None):
         
-        import threadpool
-        
         ret = None
-                
-        # Create a pool with three worker threads
+        evaluations = []
+        schema = None
         i = 0
-        pool = threadpool.ThreadPool( self.__sge.pool_size.currValue() )
+        # output files of the evaluations submitted by this call
+        claimed = set()
         for conf in self.iter:
             # print conf
             
@@ -213,101 +847,158 @@ class SGERunner(Runner):
             if paren_conf is not None:
                 cconf = paren_conf + conf
             
+            # commands executed by a single run
             pack = ""
             out_file = None
-            for _ in range(cconf.num_of_runs.currValue()):
-                for cmd in cmd_list:
-                    curr_cmd = sobstitute(cmd, cconf)
-                    
-                    curr_cmd = curr_cmd.replace('\\\n','')
-                    if curr_cmd.find('>>') != -1:
-                        out_file = curr_cmd[curr_cmd.rfind('>>')+2:].strip()
-                    pack += curr_cmd + "\n"
+            for cmd in cmd_list:
+                curr_cmd = sobstitute(cmd, cconf)
+                
+                curr_cmd = curr_cmd.replace('\\\n','')
+                if curr_cmd.find('>>') != -1:
+                    out_file = curr_cmd[curr_cmd.rfind('>>')+2:].strip()
+                pack += curr_cmd + "\n"
+            
+            (ident, completed) = journal_begin(self.__journal, cconf, 
+                    output_files([ (None, out_file) ], cconf, self.__elaborate))
+            if completed:
+                conf.setSpeedup( completed['speedup'] )
+                ret = completed['res']
+                continue
+            
+            (key, cached) = lookup_cache(self.__cache, cmd_list, cconf)
+            if cached:
+                (data, failures, runs, metrics) = cached
+                ret = cconf.WriteBack(def_vals, data, out_file, self.__elaborate, failures, runs, metrics)
+                conf.setSpeedup( cconf.getSpeedup() )
+                self.__finish(ident, cconf, ret)
+                continue
+            
+            # the runs are extracted from the whole output file, which must not hold the 
+            # runs of a previous evaluation of the configuration (e.g. with a smaller 
+            # budget, see the halving module)
+            if out_file and out_file not in claimed and os.path.exists(out_file):
+                open(out_file, 'w').close()
+            claimed.add(out_file)
             
             sge_skel = self.__sge.skel_script.currValue().replace('\\\n','\n')
-
-            if self.__use_thread_pool:
-                # Insert tasks into the queue and let them run
-                pool.queueTask(self.__run_sge, 
-                        (conf, deepcopy(cconf), sobstitute(sge_skel, cconf + self.__sge) + "\n\n" + pack, i, out_file, def_vals), None)
-                i += 1
-            else:
-                ret = self.__run_sge(conf, cconf, sobstitute(sge_skel, cconf + self.__sge) + "\n\n" + pack, i, out_file, def_vals)
-        # When all tasks are finished, allow the threads to terminate
-        pool.joinAll()
-        return ret
-                
-    def __monitor(self, jobid):
-        print '--> Monitoring execution of job %s' % jobid
-        time.sleep(self.__sge.timeout.currValue())
-        found = 0
-        while 1:
-            lines = os.popen('qstat -u {0}'.format(self.__sge.user_name.currValue())).readlines()[2:]
-            for l in lines:
-                if len(l) == 0:
-                    continue
-                values = [v for v in l.strip().split(' ') if len(v) > 0]
-                if values[0] != jobid:
-                    continue
-                
-                found = 1
-                curr = time.strftime("%d|%b|%Y@%H:%M:%S", time.gmtime())
-                start_time = time.strptime(curr.split('@')[0]+'@'+values[6] , "%d|%b|%Y@%H:%M:%S")
-                stop_time =  time.localtime(time.mktime(start_time) + 
-                            self.__sge.sqe_kill_after.currValue())
-                curr_time = time.localtime()
-                if values[4] == 'r' and curr_time > stop_time:
-                   print '\t[monitor()]: Job {0} stuck -> KILLED'.format(jobid)
-                   os.system( 'qdel {0} &'.format(jobid) )
-                   return
-                break
-                    
-            if not found:
-                return
+            script = sobstitute(sge_skel, cconf + self.__sge) + "\n\n"
             
-            found=0
-            time.sleep(self.__sge.timeout.currValue())
+            # the iterator changes the configuration in place
+            if schema is None:
+                schema = Schema(cconf)
+            ev = SGEEvaluation(conf, schema.point(cconf), script, pack, i, out_file, def_vals, key, ident)
+            i += 1
+            evaluations.append( ev )
+            if self.__array:
+                continue
+            self.__submitBatch(ev)
+            if self.__wait:
+                ev.done.wait()
+                ret = ev.ret
+        
+        if self.__array and evaluations:
+            self.__submitArray(evaluations)
+        
+        # wait for all the jobs to terminate
+        for ev in evaluations:
+            ev.done.wait()
+        if evaluations and not self.__wait:
+            ret = evaluations[-1].ret
+        return ret
+    
+    def __finish(self, ident, cconf, ret=None):
+        if self.__journal is not None:
+            self.__journal.finish(ident, cconf.getSpeedup(), ret, 
+                    [ sobstitute(self.__elaborate.out_file_name.currValue(), cconf) ])
         
-    def __run_sge(self, conf, cconf, cmd, id, out_file=None, def_vals=None):
-        # print conf
+    def __submit(self, cmd, id, args=[]):
+        # submits the script 'cmd' and returns the id of the SGE job 
         file_name = '~script.sh.' + str(id)
         open(file_name, 'w').write(cmd)
-        time.sleep(1)
-        pid = subprocess.Popen( ['qsub', file_name], stdout=subprocess.PIPE )
-        pid.wait()
-        data = pid.communicate()[0]
+        jobid = submit(file_name, self.__qsub, args)
         if os.path.exists(file_name):
             os.remove(file_name)           
-        if data.strip().startswith("Your job") and data.strip().find("has been submitted") != -1:
-            p = re.compile('\d+')
-            jobid = p.finditer(data).next().group()
-            # wait for the job to finish
-            self.__monitor(jobid)
-            if self.__extract and out_file:
-                ext_data = []
-                if os.path.exists(out_file):
-                    ext_data = extract( open(out_file).read(), self.__extract )
-                    
-                # print ext_data
-                    
-                sys.stdout.write("Extracting data... ")
-                for i in range(len(ext_data)):
-                    print ", ".join(  map(lambda x: "{0:.3f}".format(x), ext_data[i]) )
-                    
-                print "Writing results onto file: {0}".format(out_file)
-                for i in range(len(ext_data)):
-                    write( os.path.dirname(out_file) + "/~" + os.path.basename(out_file), 
-                            ",".join( map(lambda x: "{0}".format(x), ext_data[i])) + "\n" )
-                            
-                ret = cconf.WriteBack(def_vals, ext_data, out_file, self.__elaborate)
-                conf.setSpeedup( cconf.getSpeedup() )
-                return ret
+        return jobid
+    
+    def __convergence(self, ev):
+        if self.__extract and ev.out_file:
+            return get_convergence(ev.configuration(), self.__elaborate)
+    
+    def __nextBatch(self, ev):
+        convergence = self.__convergence(ev)
+        max_runs = convergence.max_runs if convergence else ev.configuration().num_of_runs.currValue()
+        # in adaptive mode the runs are submitted in batches of 'min_runs' 
+        # until the confidence interval converges
+        ev.batch = max_runs - ev.runs
+        if convergence:
+            ev.batch = min(ev.batch, max(1, convergence.min_runs))
+        return ev.pack * ev.batch
+    
+    def __submitArray(self, evaluations):
+        # the first batch of every configuration is a task of the same array
+        # job, the task table selects the commands by the SGE_TASK_ID variable.
+        # The job options are taken from the skeleton of the first configuration 
+        table = "case $SGE_TASK_ID in\n"
+        for (n, ev) in enumerate(evaluations):
+            table += "{0})\n{1};;\n".format(n+1, self.__nextBatch(ev))
+        table += "esac\n"
+        jobid = self.__submit(evaluations[0].script + table, 'array', 
+                              ['-t', '1-{0}'.format(len(evaluations))])
+        if jobid is None:
+            for ev in evaluations:
+                ev.done.set()
+            return
+        print '--> Monitoring execution of array job {0} ({1} tasks)'.format(jobid, len(evaluations))
+        for (n, ev) in enumerate(evaluations):
+            self.__watch('{0}.{1}'.format(jobid, n+1), ev)
+    
+    def __watch(self, jobid, ev):
+        self.__monitor.watch(jobid, lambda jobid, killed: self.__completed(ev, killed))
+    
+    def __submitBatch(self, ev):
+        jobid = self.__submit(ev.script + self.__nextBatch(ev), ev.id)
+        if jobid is None:
+            ev.done.set()
+            return
+        print '--> Monitoring execution of job %s' % jobid
+        self.__watch(jobid, ev)
+    
+    def __completed(self, ev, killed):
+        # invoked by the monitor once the job of 'ev' terminates
+        ev.runs += ev.batch
+        if killed:
+            ev.failures.append( RunStatus(RunStatus.TIMEOUT) )
+        convergence = self.__convergence(ev)
+        if convergence and ev.runs < convergence.max_runs and not killed and os.path.exists(ev.out_file) and \
+                not convergence.reached(ev.runs, extract_file( ev.out_file, self.__extract, CHUNK_SIZE, ev.runs )):
+            self.__submitBatch(ev)
+            return
+        try:
+            ev.ret = self.__writeBack(ev)
+        finally:
+            ev.done.set()
+    
+    def __writeBack(self, ev):
+        if self.__extract and ev.out_file:
+            ext_data = []
+            if os.path.exists(ev.out_file):
+                # the output file holds all the runs of the configuration
+                ext_data = extract_file( ev.out_file, self.__extract, CHUNK_SIZE, ev.runs )
                 
-            if out_file is None:
-                print data
-            
-        else:
-            print "ERROR submitting job to SGE: %s" % data 
-        
-        
-        
+            # print ext_data
+                
+            sys.stdout.write("Extracting data... ")
+            for i in range(len(ext_data)):
+                print ", ".join(  map(lambda x: "{0:.3f}".format(x), ext_data[i]) )
+                
+            print "Writing results onto file: {0}".format(ev.out_file)
+            for i in range(len(ext_data)):
+                results.get().sample(ev.out_file, ext_data[i])
+                        
+            store_cache(self.__cache, ev.key, ext_data, ev.failures, ev.runs)
+            cconf = ev.configuration()
+            ret = cconf.WriteBack(ev.def_vals, ext_data, ev.out_file, self.__elaborate, 
+                                  ev.failures, ev.runs)
+            ev.conf.setSpeedup( cconf.getSpeedup() )
+            self.__finish(ev.ident, cconf, ret)
+            return ret
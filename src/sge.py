@@ -0,0 +1,197 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import re, time, shlex, subprocess, threading, traceback
+import xml.etree.ElementTree as ET
+
+# commands used to interact with the grid engine, they can be replaced by the
+# 'qsub', 'qstat' and 'qdel' parameters of the [SGE] section
+QSUB = 'qsub'
+QSTAT = 'qstat'
+QDEL = 'qdel'
+
+def sge_command(sge, name, default):
+    if name in sge.parameters.keys():
+        return str(sge.parameters[name].currValue())
+    return default
+
+def parse_time(value):
+    """ Converts the timestamps reported by qstat -xml to seconds since epoch
+
+    >>> parse_time('2010-05-18T10:11:12') - parse_time('2010-05-18T10:10:00')
+    72.0
+    """
+    if not value:
+        return None
+    return time.mktime( time.strptime(value.split('.')[0], '%Y-%m-%dT%H:%M:%S') )
+
+def task_ids(tasks):
+    """ Expands the task ranges of array jobs reported by qstat
+
+    >>> task_ids('3'), task_ids('1,4-10:3')
+    (['3'], ['1', '4', '7', '10'])
+    """
+    ids = []
+    for item in tasks.split(','):
+        m = re.match('(\d+)(?:-(\d+)(?::(\d+))?)?$', item.strip())
+        if m is None:
+            continue
+        (first, last, step) = m.groups()
+        ids += map(str, range(int(first), int(last or first) + 1, int(step or 1)))
+    return ids
+
+def parse_qstat_xml(text):
+    """ Returns, for each job listed by 'qstat -xml', its state and the time it
+    started running (None while it's pending). The tasks of array jobs are 
+    listed as well, identified by 'jobid.taskid'
+
+    >>> jobs = parse_qstat_xml('<job_info><queue_info><job_list state="running">'
+    ...     '<JB_job_number>12</JB_job_number><state>r</state>'
+    ...     '<JAT_start_time>2010-05-18T10:11:12</JAT_start_time></job_list>'
+    ...     '</queue_info><job_info><job_list state="pending">'
+    ...     '<JB_job_number>13</JB_job_number><state>qw</state></job_list>'
+    ...     '</job_info></job_info>')
+    >>> sorted(jobs.keys()), jobs['12'][0], jobs['13']
+    (['12', '13'], 'r', ('qw', None))
+    >>> sorted(parse_qstat_xml('<job_info><job_list><JB_job_number>7</JB_job_number>'
+    ...     '<state>qw</state><tasks>2-3:1</tasks></job_list></job_info>').keys())
+    ['7', '7.2', '7.3']
+    """
+    jobs = {}
+    for job in ET.fromstring(text).iter('job_list'):
+        jobid = job.findtext('JB_job_number', '').strip()
+        if not jobid:
+            continue
+        status = ( job.findtext('state', '').strip(), parse_time(job.findtext('JAT_start_time')) )
+        jobs[jobid] = status
+        for task in task_ids( job.findtext('tasks', '') ):
+            jobs['{0}.{1}'.format(jobid, task)] = status
+    return jobs
+
+def submit(script, qsub=QSUB, args=[]):
+    """ Submits the job script 'script' and returns its SGE job id, None if the
+    submission failed. 'args' are additional options of qsub """
+    pid = subprocess.Popen( shlex.split(qsub) + args + [script], stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT )
+    data = pid.communicate()[0]
+    m = re.search('Your job(?:-array)? (\d+)', data)
+    if pid.returncode == 0 and m and data.find("has been submitted") != -1:
+        return m.group(1)
+    print "ERROR submitting job to SGE: %s" % data.strip()
+
+class JobMonitor:
+    """ Watches the SGE jobs submitted by the runners. A single thread invokes
+    'qstat -xml' once every 'interval' seconds for all the outstanding jobs,
+    jobs no longer listed are completed and their callback is invoked (from the
+    monitoring thread). Jobs running for more than 'kill_after' seconds are
+    considered stuck and deleted. The tasks of an array job are watched
+    individually with the 'jobid.taskid' identifier. """
+
+    def __init__(self, interval, user=None, kill_after=None, qstat=QSTAT, qdel=QDEL):
+        self.__interval = interval
+        self.__user = user
+        self.__kill_after = kill_after
+        self.__qstat = qstat
+        self.__qdel = qdel
+        self.__lock = threading.Lock()
+        # callbacks of the outstanding jobs, indexed by job id
+        self.__jobs = {}
+        self.__thread = None
+
+    def watch(self, jobid, callback):
+        """ 'callback(jobid, killed)' is invoked once the job terminates """
+        self.__lock.acquire()
+        self.__jobs[jobid] = callback
+        if self.__thread is None:
+            # the thread terminates as soon as there are no jobs to watch
+            self.__thread = threading.Thread(target=self.__loop)
+            self.__thread.daemon = True
+            self.__thread.start()
+        self.__lock.release()
+
+    def __poll(self):
+        cmd = shlex.split(self.__qstat) + ['-xml']
+        if self.__user:
+            cmd += ['-u', self.__user]
+        pid = subprocess.Popen( cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE )
+        (out, err) = pid.communicate()
+        if pid.returncode != 0:
+            print "ERROR querying SGE: %s" % err.strip()
+            return None
+        try:
+            return parse_qstat_xml(out)
+        except ET.ParseError:
+            print "ERROR parsing the output of qstat"
+            return None
+
+    def __loop(self):
+        while True:
+            self.__lock.acquire()
+            if not self.__jobs:
+                self.__thread = None
+                self.__lock.release()
+                return
+            self.__lock.release()
+
+            time.sleep(self.__interval)
+            listed = self.__poll()
+            if listed is None:
+                # qstat failed, jobs are checked again at the next interval
+                continue
+
+            done = []
+            now = time.time()
+            self.__lock.acquire()
+            for (jobid, callback) in self.__jobs.items():
+                if jobid not in listed:
+                    done.append( (jobid, callback, False) )
+                    continue
+                (state, start_time) = listed[jobid]
+                if self.__kill_after and state == 'r' and start_time is not None and \
+                        now - start_time > self.__kill_after:
+                    print '\t[monitor()]: Job {0} stuck -> KILLED'.format(jobid)
+                    subprocess.call( shlex.split(self.__qdel) + [jobid] )
+                    done.append( (jobid, callback, True) )
+            for (jobid, _, _) in done:
+                del self.__jobs[jobid]
+            self.__lock.release()
+
+            for (jobid, callback, killed) in done:
+                try:
+                    callback(jobid, killed)
+                except Exception:
+                    # the monitor must keep running for the other jobs
+                    traceback.print_exc()
+
+# monitors shared by the runners, indexed by their settings
+_monitors = {}
+_monitors_lock = threading.Lock()
+
+def shared_monitor(sge):
+    """ Returns the monitor of the jobs submitted with the [SGE] section 'sge',
+    all the runners using the same settings share it """
+    user = sge.user_name.currValue() if 'user_name' in sge.parameters.keys() else None
+    kill_after = sge.sqe_kill_after.currValue() if 'sqe_kill_after' in sge.parameters.keys() else None
+    settings = ( sge.timeout.currValue(), user, kill_after,
+                 sge_command(sge, 'qstat', QSTAT), sge_command(sge, 'qdel', QDEL) )
+    _monitors_lock.acquire()
+    if settings not in _monitors:
+        _monitors[settings] = JobMonitor(*settings)
+    _monitors_lock.release()
+    return _monitors[settings]
@@ -0,0 +1,205 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import re, math
+from util import avg, std, ci95, t95
+from histogram import Histogram
+
+try:
+    import numpy
+except ImportError:
+    # the pure Python implementation is used
+    numpy = None
+
+# Aggregation functions which can be used in the out_file_format:
+#   AVG, STD, MIN, MAX  mean, (population) standard deviation, minimum, maximum
+#   MEDIAN              median
+#   Pn                  n-th percentile (linear interpolation), e.g. P90, P99.9
+#   CI95                half-width of the 95% confidence interval of the mean
+#   GEOMEAN             geometric mean (0 unless all the values are positive)
+#   TRIMn               mean of the values left removing n% of them from each end
+AGGREGATION = re.compile('^(AVG|STD|MIN|MAX|MEDIAN|CI95|GEOMEAN|P|TRIM)(\d+(?:\.\d+)?)?\((.+)\)$')
+
+def parse(entry):
+    """ Splits an aggregation of out_file_format into function, argument and
+    column, returns None when 'entry' is not an aggregation
+
+    >>> parse('P90(time)'), parse('AVG(@wall)'), parse('P(time)'), parse('mat_size')
+    (('P', 90.0, 'time'), ('AVG', None, '@wall'), None, None)
+    """
+    m = AGGREGATION.match(entry)
+    if m is None:
+        return None
+    (function, arg, column) = m.groups()
+    if (function in ('P', 'TRIM')) != (arg is not None):
+        return None
+    return (function, float(arg) if arg is not None else None, column)
+
+def percentile(values, p):
+    """ Percentile of the sorted list 'values'
+
+    >>> percentile([1, 2, 3, 4], 50), percentile([1, 2, 3, 4], 90), percentile([5], 99)
+    (2.5, 3.7, 5)
+    """
+    rank = p / 100.0 * (len(values) - 1)
+    lo = int(math.floor(rank))
+    if lo + 1 >= len(values):
+        return values[-1]
+    return values[lo] + (values[lo+1] - values[lo]) * (rank - lo)
+
+def trimmed(values, p):
+    # the sorted 'values' without p% of them at each end
+    cut = int(len(values) * p / 100.0)
+    return values[cut:len(values)-cut] if cut * 2 < len(values) else values
+
+class Summary:
+    """ Aggregates the columns of 'rows' (a list of samples with 'width' values
+    each). With NumPy every function is computed on all the columns at once,
+    otherwise the columns are sorted once for all the order statistics.
+
+    >>> s = Summary([(1, 4.0), (2, 1.0), (3, 2.0), (10, 8.0)], 2)
+    >>> s.all('MAX'), s.value('MEDIAN', None, 0), s.value('TRIM', 25, 1)
+    ([10, 8.0], 2.5, 3.0)
+    >>> '{0:.4f}'.format( s.value('GEOMEAN', None, 1) ), s.value('P', 50, 1)
+    ('2.8284', 3.0)
+    >>> Summary([], 2).all('AVG')
+    [0, 0]
+
+    Samples made of histograms (see the 'histogram' samples mode of the
+    extractor) are merged column by column and aggregated as a whole:
+
+    >>> (h1, h2) = (Histogram(), Histogram())
+    >>> for v in range(1, 101): h1.append(v); h2.append(v + 100)
+    >>> s = Summary([(h1,), (h2,)], 1)
+    >>> s.all('AVG'), s.all('MAX'), abs(s.value('P', 99, 0) - 198) < 1
+    ([100.5], [200], True)
+    """
+
+    def __init__(self, rows, width):
+        self.__width = width
+        self.__size = len(rows)
+        self.__results = {}
+        self.__histograms = None
+        if rows and isinstance(rows[0][0], Histogram):
+            self.__histograms = [ reduce(lambda acc, h: acc.merge(h), column, Histogram())
+                                    for column in zip(*rows) ]
+            self.__size = self.__histograms[0].count
+        elif numpy is not None:
+            self.__data = numpy.array(rows, dtype=float).reshape(len(rows), width)
+            # columns of integers (judging from the first sample), their
+            # minimum and maximum are reported as integers
+            self.__ints = [ isinstance(v, (int, long)) for v in rows[0] ] if rows else []
+        else:
+            self.__columns = [ list(column) for column in zip(*rows) ]
+        self.__sorted = None
+
+    def __sortedColumns(self):
+        if self.__sorted is None:
+            self.__sorted = [ sorted(column) for column in self.__columns ]
+        return self.__sorted
+
+    def __compute(self, function, arg):
+        if self.__size == 0:
+            return [0] * self.__width
+        if self.__histograms is not None:
+            return [ self.__computeHistogram(h, function, arg) for h in self.__histograms ]
+        if numpy is not None:
+            return self.__computeNumPy(function, arg)
+
+        if function == 'AVG':
+            return [ avg(column) for column in self.__columns ]
+        if function == 'STD':
+            return [ std(column, avg(column)) for column in self.__columns ]
+        if function == 'MIN':
+            return [ min(column) for column in self.__columns ]
+        if function == 'MAX':
+            return [ max(column) for column in self.__columns ]
+        if function == 'CI95':
+            return [ ci95(column) for column in self.__columns ]
+        if function == 'GEOMEAN':
+            return [ math.exp(avg(map(math.log, column))) if min(column) > 0 else 0.0
+                        for column in self.__columns ]
+        if function == 'MEDIAN':
+            return [ percentile(column, 50) for column in self.__sortedColumns() ]
+        if function == 'P':
+            return [ percentile(column, arg) for column in self.__sortedColumns() ]
+        if function == 'TRIM':
+            return [ avg(trimmed(column, arg)) for column in self.__sortedColumns() ]
+        raise ValueError("Unknown aggregation function '{0}'".format(function))
+
+    def __computeHistogram(self, h, function, arg):
+        if function == 'AVG':
+            return h.mean()
+        if function == 'STD':
+            return h.std()
+        if function == 'MIN':
+            return h.min
+        if function == 'MAX':
+            return h.max
+        if function == 'CI95':
+            if h.count < 2:
+                return float('inf')
+            return h.std() * math.sqrt(h.count / (h.count - 1.0)) / math.sqrt(h.count) * t95(h.count)
+        if function == 'GEOMEAN':
+            return h.geomean()
+        if function == 'MEDIAN':
+            return h.percentile(50)
+        if function == 'P':
+            return h.percentile(arg)
+        if function == 'TRIM':
+            return h.trimmedMean(arg)
+        raise ValueError("Unknown aggregation function '{0}'".format(function))
+
+    def __computeNumPy(self, function, arg):
+        data = self.__data
+        if function == 'AVG':
+            values = data.mean(axis=0, dtype=float)
+        elif function == 'STD':
+            values = data.std(axis=0, dtype=float)
+        elif function in ('MIN', 'MAX'):
+            values = data.min(axis=0) if function == 'MIN' else data.max(axis=0)
+            return [ int(v) if is_int else v for (v, is_int) in zip(values.tolist(), self.__ints) ]
+        elif function == 'CI95':
+            if self.__size < 2:
+                return [float('inf')] * self.__width
+            values = data.std(axis=0, ddof=1, dtype=float) / math.sqrt(self.__size) * t95(self.__size)
+        elif function == 'GEOMEAN':
+            positive = (data > 0).all(axis=0)
+            values = numpy.where(positive, numpy.exp(numpy.log(numpy.where(positive, data, 1)).mean(axis=0)), 0)
+        elif function == 'MEDIAN':
+            values = numpy.median(data, axis=0)
+        elif function == 'P':
+            values = numpy.percentile(data, arg, axis=0)
+        elif function == 'TRIM':
+            cut = int(self.__size * arg / 100.0)
+            if cut * 2 >= self.__size:
+                cut = 0
+            values = numpy.sort(data, axis=0)[cut:self.__size-cut].mean(axis=0)
+        else:
+            raise ValueError("Unknown aggregation function '{0}'".format(function))
+        return values.tolist()
+
+    def all(self, function, arg=None):
+        """ Returns the value of 'function' for each column """
+        if (function, arg) not in self.__results:
+            self.__results[(function, arg)] = self.__compute(function, arg)
+        return self.__results[(function, arg)]
+
+    def value(self, function, arg, column):
+        return self.all(function, arg)[column]
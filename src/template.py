@@ -0,0 +1,123 @@
+'''
+    BenchRunner 
+    Copyright (C) 2010  Simone Pellegrini
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+'''
+
+import string, threading
+
+# number of renderings remembered by each template
+MEMO_SIZE = 4096
+
+# the key of a parameter not given to render()
+MISSING = object()
+
+class SubstitutionCycle(ValueError):
+    pass
+
+class Template:
+    """ A string referring parameters as {name} (the syntax of str.format),
+    parsed once into literal and reference segments. The value of a parameter
+    can refer other parameters in turn, such values are rendered first (a
+    reference cycle is an error).
+
+    >>> from parameter import Parameter
+    >>> params = dict([ (p.name, p) for p in [ Parameter('n', [10, 20], 10),
+    ...     Parameter('out', ['res_{n}.txt'], 'res_{n}.txt') ] ])
+    >>> compile('./prog {n} >> {out} {{x}}').render(params)
+    './prog 10 >> res_10.txt {x}'
+    >>> compile('{out} {m}').render(params, partial=True)
+    'res_10.txt {m}'
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.__segments = []
+        for (literal, name, spec, conversion) in string.Formatter().parse(text):
+            self.__segments.append( (literal, name, spec, conversion) )
+        self.names = frozenset([ name for (_, name, _, _) in self.__segments if name is not None ])
+        self.__memo = {}
+        self.__lock = threading.Lock()
+
+    def __render(self, params, partial, stack):
+        out = []
+        for (literal, name, spec, conversion) in self.__segments:
+            out.append( literal.replace('{', '{{').replace('}', '}}') if partial else literal )
+            if name is None:
+                continue
+            if name not in params:
+                if not partial:
+                    raise KeyError(name)
+                out.append( '{' + name + ('!' + conversion if conversion else '') +
+                            (':' + spec if spec else '') + '}' )
+                continue
+            value = params[name].currValue()
+            if isinstance(value, basestring) and '{' in value:
+                if name in stack:
+                    raise SubstitutionCycle("Cycle in the substitution of the parameters: {0}".format(
+                                                " -> ".join(stack + [name])))
+                value = compile(value).__render(params, partial, stack + [name])
+            out.append( str(value) )
+        return "".join(out)
+
+    def render(self, params, partial=False):
+        """ Replaces the references with the current values of the parameters
+        in the dictionary 'params' (name -> Parameter). With 'partial' the
+        references to the parameters not in 'params' are kept. The result is
+        remembered for the values of the referred parameters, unless they
+        refer other parameters. """
+        key = [ partial ]
+        for name in self.names:
+            if name in params:
+                value = params[name].currValue()
+                if isinstance(value, basestring) and '{' in value:
+                    return self.__render(params, partial, [])
+                # the type tells apart values which compare equal (e.g. 1 and 1.0)
+                key.append( (type(value), value) )
+            else:
+                key.append(MISSING)
+        key = tuple(key)
+        try:
+            hash(key)
+        except TypeError:
+            return self.__render(params, partial, [])
+        self.__lock.acquire()
+        try:
+            if key in self.__memo:
+                return self.__memo[key]
+        finally:
+            self.__lock.release()
+        ret = self.__render(params, partial, [])
+        self.__lock.acquire()
+        if len(self.__memo) >= MEMO_SIZE:
+            self.__memo.clear()
+        self.__memo[key] = ret
+        self.__lock.release()
+        return ret
+
+# templates parsed so far
+_templates = {}
+_lock = threading.Lock()
+
+def compile(text):
+    """ Returns the Template of 'text', each string is parsed only once """
+    template = _templates.get(text)
+    if template is None:
+        template = Template(text)
+        _lock.acquire()
+        _templates[text] = template
+        _lock.release()
+    return template
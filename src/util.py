@@ -1,13 +1,10 @@
 
 from math import sqrt
+import template
 
 def sobstitute(cmd, conf):
-    new_cmd = cmd
-    old_cmd = None
-    while new_cmd != old_cmd:
-        old_cmd = new_cmd
-        new_cmd = new_cmd.format(**conf.parameters)
-    return new_cmd
+    # the template of 'cmd' is parsed once and its renderings are remembered
+    return template.compile(cmd).render(conf.parameters)
 
 def convert(val):
     if val is None:
@@ -40,6 +37,65 @@ def std(values, avg):
         acc += (val - avg)**2
     return sqrt(acc/len(values))
 
+# two-sided 95% quantiles of the Student's t distribution for 1..30 degrees of freedom
+T_95 = [ 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+          2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+          2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042 ]
+
+def t95(n):
+    """ Quantile of the Student's t distribution used for 'n' samples """
+    return T_95[n-2] if n-2 < len(T_95) else 1.96
+
+def ci95(values):
+    """ Half-width of the 95% confidence interval of the mean of 'values' 
+    
+    >>> "{0:.4f}".format(ci95([1, 2, 3]))
+    '2.4843'
+    """
+    n = len(values)
+    if n < 2:
+        return float('inf')
+    mean = avg(values)
+    acc = 0.0
+    for val in values:
+        acc += (val - mean)**2
+    return t95(n) * sqrt(acc/(n-1)) / sqrt(n)
+
+def rel_ci95(values):
+    """ Half-width of the 95% confidence interval relative to the mean """
+    half_width = ci95(values)
+    mean = abs(avg(values)) if len(values) else 0
+    if mean == 0:
+        return 0.0 if half_width == 0 else float('inf')
+    return half_width / mean
+
 def gen_file_name(name):
     import os
-    return os.path.dirname(name) + "/~" + os.path.basename(name)
\ No newline at end of file
+    return os.path.dirname(name) + "/~" + os.path.basename(name)
+
+def available_cores():
+    import os
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    import multiprocessing
+    return range(multiprocessing.cpu_count())
+
+def core_groups(n):
+    """ Splits the cores available to this process into (at most) n disjoint 
+    groups of the same size.
+    
+    >>> core_groups(1) == [available_cores()]
+    True
+    """
+    cores = available_cores()
+    n = max(1, min(n, len(cores)))
+    size = len(cores) / n
+    return [ cores[i*size:(i+1)*size] for i in range(n) ]
+
+def pin_to_cores(cores):
+    import os
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    else:
+        # python versions without sched_setaffinity, rely on taskset
+        os.system('taskset -pc {0} {1} > /dev/null'.format(",".join(map(str, cores)), os.getpid()))